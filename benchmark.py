@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+import db
+import migrations
+import synthetic
+
+# Замеры горячих функций bot.py на синтетической базе заданного размера.
+# База создаётся один раз (или берётся готовая с --reuse), результаты
+# сохраняются в JSON и могут сравниваться с прошлым прогоном через --compare.
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def measure(name, func, ops):
+    durations = []
+    started = time.perf_counter()
+    for _ in range(ops):
+        op_started = time.perf_counter()
+        await func()
+        durations.append(time.perf_counter() - op_started)
+    elapsed = time.perf_counter() - started
+    durations.sort()
+    result = {
+        "ops": ops,
+        "ops_per_sec": round(ops / elapsed, 1) if elapsed else None,
+        "mean_ms": round(elapsed / ops * 1000, 3),
+        "p50_ms": round(percentile(durations, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 3),
+    }
+    print(f"{name:32} {result['ops_per_sec']:>10} оп/с  p50 {result['p50_ms']:>9} мс  p99 {result['p99_ms']:>9} мс")
+    return result
+
+
+def _git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run(args):
+    # Модуль бота создаёт Bot при импорте, поэтому импортируется после configure()
+    import bot as app
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.types import Message
+
+    app.bot.session = synthetic.StubSession()
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    rng = random.Random(1)
+
+    class_rows = await db.fetchall("SELECT school, class FROM schedule")
+    user_count = await db.fetchval("SELECT MAX(user_id) FROM users", default=0)
+
+    def random_class():
+        return rng.choice(class_rows)
+
+    async def next_lesson():
+        user_school, user_class = random_class()
+        await app.find_next_lesson_date(user_class, user_school, rng.choice(synthetic.SUBJECTS).split("/")[0], rng.choice(("1", "2")))
+
+    async def schedule():
+        user_school, user_class = random_class()
+        await app.get_schedule(user_class, user_school)
+
+    async def subject_keyboard():
+        user_school, user_class = random_class()
+        await app.create_subject_keyboard(user_class, user_school, rng.choice(("1", "2")), day=rng.choice(app.schedules.WEEKDAYS[:6]))
+
+    async def school_keyboard():
+        await app.create_school_keyboard()
+
+    tomorrow = datetime.now() + timedelta(days=1)
+
+    async def view_homework():
+        user_school, user_class = random_class()
+        await app.homework.view_day(user_class, user_school, rng.choice(("1", "2")), tomorrow)
+
+    async def view_homework_cold():
+        user_school, user_class = random_class()
+        app.schedules.invalidate_schedule(user_class, user_school)
+        app.homework.invalidate_day(user_class, user_school)
+        await app.homework.view_day(user_class, user_school, rng.choice(("1", "2")), tomorrow)
+
+    storage = MemoryStorage()
+
+    async def user_search():
+        query = rng.choice([str(rng.randint(1, user_count)), f"user{rng.randint(1, user_count)}", rng.choice(class_rows)[0]])
+        message = Message.model_validate(synthetic.message(1, query)["message"], context={"bot": app.bot})
+        state = FSMContext(storage, StorageKey(bot_id=app.bot.id, chat_id=1, user_id=1))
+        await app.process_user_search(message, state)
+
+    async def editors_activity():
+        await app.check_editors_activity.func()
+
+    benchmarks = [
+        ("find_next_lesson_date", next_lesson, args.ops),
+        ("get_schedule", schedule, args.ops),
+        ("create_subject_keyboard", subject_keyboard, args.ops),
+        ("create_school_keyboard", school_keyboard, max(1, args.ops // 100)),
+        ("viewhw_render", view_homework, args.ops),
+        ("viewhw_render_cold", view_homework_cold, args.ops),
+        ("process_user_search", user_search, max(1, args.ops // 10)),
+        ("check_editors_activity", editors_activity, args.job_runs),
+    ]
+    results = {}
+    for name, func, ops in benchmarks:
+        if args.only and name not in args.only:
+            continue
+        results[name] = await measure(name, func, ops)
+    return results
+
+
+def compare(results, path):
+    with open(path, encoding="utf-8") as f:
+        previous = json.load(f)["results"]
+    print(f"\nСравнение с {path} (p50, изменение):")
+    for name, result in results.items():
+        old = previous.get(name)
+        if old and old["p50_ms"]:
+            change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"]
+            print(f"{name:32} {old['p50_ms']:>9} → {result['p50_ms']:>9} мс  {change:+.0%}")
+
+
+async def main(args):
+    if os.path.exists(args.db) and not args.reuse:
+        raise SystemExit(f"{args.db} уже существует: удалите его или запустите с --reuse")
+    db.configure(path=args.db)
+    try:
+        await db.run(migrations.migrate)
+        if not args.reuse:
+            started = time.perf_counter()
+            await db.run(synthetic.seed_scale, args.schools, args.classes, args.users_per_class, args.homework)
+            print(f"База заполнена за {time.perf_counter() - started:.1f} с")
+        results = await run(args)
+    finally:
+        db.shutdown()
+
+    report = {
+        "version": _git_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {
+            "schools": args.schools,
+            "classes": args.classes,
+            "users_per_class": args.users_per_class,
+            "homework": args.homework,
+            "ops": args.ops,
+            "reuse": args.reuse,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Замеры производительности бота на синтетической базе")
+    parser.add_argument("--db", default="bench_homework.db", help="временная база; существующая используется только с --reuse")
+    parser.add_argument("--reuse", action="store_true", help="не заполнять базу, взять уже созданную")
+    parser.add_argument("--schools", type=int, default=2000)
+    parser.add_argument("--classes", type=int, default=20000)
+    parser.add_argument("--users-per-class", type=int, default=10)
+    parser.add_argument("--homework", type=int, default=1000000)
+    parser.add_argument("--ops", type=int, default=2000, help="сколько вызовов на функцию (для тяжёлых меньше)")
+    parser.add_argument("--job-runs", type=int, default=3, help="сколько раз запускать check_editors_activity")
+    parser.add_argument("--only", nargs="+", help="запустить только указанные замеры")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="JSON", help="сравнить с результатами прошлого прогона")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))
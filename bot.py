@@ -1,57 +1,64 @@
-import sqlite3
+import argparse
 import logging
 import asyncio
-import json
+import os
+import random
+import time
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, Router, F
-from aiogram.filters import Command, BaseFilter
+from aiogram.filters import Command, CommandObject, BaseFilter
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.types import BotCommand, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from typing import Optional
 from config import TOKEN, ADMIN_CHAT_ID
 import aiocron
+import db
+import dates
+import homework
+import metrics
+import migrations
+import querytrace
+import schedules
+import schools
+import webhook
+from fsm_storage import SQLiteStorage
+from middlewares import ApiMetricsMiddleware, HandlerMetricsMiddleware, ThrottlingMiddleware, UpdateRecorder, UserProfileMiddleware
+from notifier import Notifier
+from users import USER_SEARCH_MIN_LENGTH, UserProfile, invalidate_profile, profile_cache, profile_cache_stats, search_users
+from schedules import schedule_cache, schedule_cache_stats
 
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=SQLiteStorage())
+notifier = Notifier(bot)
 router = Router()
 dp.include_router(router)
+recorder = UpdateRecorder()
+throttling = ThrottlingMiddleware()
+dp.update.outer_middleware(recorder)
+dp.update.outer_middleware(throttling)
+dp.update.outer_middleware(UserProfileMiddleware())
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
+bot.session.middleware(ApiMetricsMiddleware())
 logging.basicConfig(level=logging.INFO)
-
-# Инициализация базы данных
-def init_db():
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS homework (
-                        id INTEGER PRIMARY KEY,
-                        user_id INTEGER,
-                        date TEXT,
-                        group_number TEXT,
-                        class TEXT,
-                        school TEXT,
-                        subject TEXT,
-                        task TEXT)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS users (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT,
-                        class TEXT,
-                        school TEXT,
-                        group_number TEXT,
-                        role TEXT DEFAULT 'viewer',
-                        balance INTEGER DEFAULT 0,
-                        referrer_id INTEGER DEFAULT NULL,
-                        editor_request BOOLEAN DEFAULT FALSE)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS schedule (
-                        id INTEGER PRIMARY KEY,
-                        user_id INTEGER,
-                        class TEXT,
-                        school TEXT,
-                        schedule_json TEXT)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS schools (
-                        id INTEGER PRIMARY KEY,
-                        name TEXT UNIQUE)''')
-        conn.commit()
-init_db()
+logger = logging.getLogger(__name__)
+
+metrics.Gauge("bot_notifier_queue_size", "Сообщения в очереди рассылки", lambda: notifier.qsize())
+metrics.Gauge("bot_db_pool_pending", "Обращения к базе, ждущие поток пула", db.pending)
+metrics.Gauge("bot_fsm_unflushed", "Состояния FSM, ещё не записанные в базу", lambda: dp.storage.unflushed())
+metrics.Gauge(
+    "bot_cache_entries", "Записей в кэше",
+    lambda: {("profiles",): len(profile_cache), ("schedules",): len(schedule_cache), ("homework_views",): len(homework.view_cache)},
+    ("cache",)
+)
+metrics.Gauge(
+    "bot_cache_hit_ratio", "Доля попаданий в кэш",
+    lambda: {("profiles",): profile_cache.stats()["hit_rate"], ("schedules",): schedule_cache.stats()["hit_rate"],
+             ("homework_views",): homework.view_cache.stats()["hit_rate"]},
+    ("cache",)
+)
 
 
 # Состояния
@@ -76,6 +83,7 @@ class HomeworkState(StatesGroup):
     waiting_for_subject = State()
     waiting_for_task = State()
     waiting_for_view_date = State()
+    waiting_for_search = State()
 
 class ScheduleState(StatesGroup):
     waiting_for_day = State()
@@ -87,130 +95,68 @@ class ScheduleState(StatesGroup):
 async def handle_group_messages(message: types.Message):
     await message.answer("🚫 Бот работает только в лс.")
 
+# Профиль пользователя загружается один раз на апдейт в UserProfileMiddleware
 class IsBannedFilter(BaseFilter):
-    async def __call__(self, message: types.Message) -> bool:
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT role FROM users WHERE user_id = ?", (message.from_user.id,))
-            result = cur.fetchone()
-            return result and result[0] == "ban"
+    async def __call__(self, message: types.Message, profile: Optional[UserProfile] = None) -> bool:
+        if profile is not None and profile.is_banned:
+            metrics.FILTER_REJECTIONS.inc("banned")
+            return True
+        return False
 
 class HasSchoolAndClassFilter(BaseFilter):
-    async def __call__(self, message: types.Message) -> bool:
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT school, class FROM users WHERE user_id = ?", (message.from_user.id,))
-            result = cur.fetchone()
-            
-            if result and result[0] is not None and result[1] is not None:
-                return True
-            else:
-                await message.answer("❌ Вы не зарегистрировали школу и класс.\n/start")
-                return False
+    async def __call__(self, message: types.Message, profile: Optional[UserProfile] = None) -> bool:
+        if profile and profile.has_school_and_class:
+            return True
+        else:
+            metrics.FILTER_REJECTIONS.inc("no_school_or_class")
+            await message.answer("❌ Вы не зарегистрировали школу и класс.\n/start")
+            return False
 
 class IsEditorOrVipOrAdminFilter(BaseFilter):
-    async def __call__(self, message: types.Message, bot: Bot) -> bool:
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT role FROM users WHERE user_id = ?", (message.from_user.id,))
-            result = cur.fetchone()
-            
-            if result and result[0] in ["editor", "vip", "admin"]:
-                return True
-            else:
-                await message.answer(
-                    "❌ У вас нет прав для выполнения этой команды.",
-                    reply_markup=create_request_editor_keyboard()
-                )
-                return False
+    async def __call__(self, message: types.Message, profile: Optional[UserProfile] = None) -> bool:
+        if profile and profile.is_editor_or_vip:
+            return True
+        else:
+            metrics.FILTER_REJECTIONS.inc("not_editor")
+            await message.answer(
+                "❌ У вас нет прав для выполнения этой команды.",
+                reply_markup=create_request_editor_keyboard()
+            )
+            return False
 
 class IsAdminFilter(BaseFilter):
-    async def __call__(self, message: types.Message) -> bool:
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT role FROM users WHERE user_id = ?", (message.from_user.id,))
-            result = cur.fetchone()
-            return result and result[0] == "admin"
+    async def __call__(self, message: types.Message, profile: Optional[UserProfile] = None) -> bool:
+        if profile is not None and profile.is_admin:
+            return True
+        metrics.FILTER_REJECTIONS.inc("not_admin")
+        return False
 
 
 
 
 # Вспомогательные функции
-async def check_user_role(user_id):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-        result = cur.fetchone()
-        return result[0] if result else None
+def check_user_role(profile):
+    return profile.role if profile else None
 
-async def is_editor_or_vip(user_id):
-    role = await check_user_role(user_id)
-    return role in ["editor", "vip", "admin"]
+def is_editor_or_vip(profile):
+    return profile is not None and profile.is_editor_or_vip
 
 async def count_editors_in_class(user_class, user_school):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM users WHERE class = ? AND school = ? AND role = 'editor'", (user_class, user_school))
-        result = cur.fetchone()
-        return result[0] if result else 0
+    return await db.fetchval(
+        "SELECT COUNT(*) FROM users WHERE class = ? AND school = ? AND role = 'editor'",
+        (user_class, user_school), default=0
+    )
 
-def find_next_lesson_date(user_class, user_school, subject, user_group=None):
-    today = datetime.now()
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT schedule_json FROM schedule WHERE class = ? AND school = ?", (user_class, user_school))
-        result = cur.fetchone()
-        
-        if result:
-            schedule = json.loads(result[0])
-            for i in range(1, 14):
-                date = today + timedelta(days=i)
-                day_of_week = date.strftime("%A")
-                
-                if day_of_week in schedule:
-                    for s in schedule[day_of_week]:
-                        if "/" in s:
-                            s_parts = s.split("/")
-                            if user_group and s_parts[int(user_group) - 1] == subject:
-                                return date.strftime("%y %m %d")
-                        elif s == subject:
-                            return date.strftime("%y %m %d")
-    return None
+async def find_next_lesson_date(user_class, user_school, subject, user_group=None):
+    date = await schedules.next_lesson_date(user_class, user_school, subject, user_group, datetime.now())
+    return date.strftime("%y %m %d") if date else None
 
 async def get_schedule(user_class, user_school):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT schedule_json FROM schedule WHERE class = ? AND school = ?", (user_class, user_school))
-        result = cur.fetchone()
-        if result:
-            return json.loads(result[0])
-        return None
+    return await schedules.load(user_class, user_school)
 
-async def update_schedule(user_class, user_school, schedule):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        schedule_json = json.dumps(schedule, ensure_ascii=False)
-        cur.execute("SELECT id FROM schedule WHERE class = ? AND school = ?", (user_class, user_school))
-        result = cur.fetchone()
-        if result:
-            cur.execute("UPDATE schedule SET schedule_json = ? WHERE class = ? AND school = ?", (schedule_json, user_class, user_school))
-        else:
-            cur.execute("INSERT INTO schedule (user_id, class, school, schedule_json) VALUES (?, ?, ?, ?)", 
-                         (user_id, user_class, user_school, schedule_json))
-        conn.commit()
-
-async def update_schedule(user_id, user_class, user_school, schedule):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        schedule_json = json.dumps(schedule, ensure_ascii=False)
-        cur.execute("SELECT id FROM schedule WHERE class = ? AND school = ?", (user_class, user_school))
-        result = cur.fetchone()
-        if result:
-            cur.execute("UPDATE schedule SET schedule_json = ? WHERE class = ? AND school = ?", (schedule_json, user_class, user_school))
-        else:
-            cur.execute("INSERT INTO schedule (user_id, class, school, schedule_json) VALUES (?, ?, ?, ?)", 
-                         (user_id, user_class, user_school, schedule_json))
-        conn.commit()
+async def update_schedule(user_id, user_class, user_school, day, subjects):
+    await schedules.save_day(user_id, user_class, user_school, schedules.WEEKDAYS.index(day), subjects)
+    homework.invalidate_day(user_class, user_school)
 
 
 # клавиатуры
@@ -242,25 +188,29 @@ def create_class_letter_keyboard(grade):
     builder.adjust(2)
     return builder.as_markup()
 
-def create_school_keyboard():
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM schools")
-        schools = cur.fetchall()
-    
+async def create_school_keyboard(query=None, page=0):
+    # Одна страница каталога школ; query — текст поиска, который пользователь написал боту
+    await schools.ensure_loaded()
+    items, page, pages = schools.page(schools.search(query), page)
+
     builder = InlineKeyboardBuilder()
-    for school in schools:
-        builder.button(text=school[0], callback_data=f"school_{school[0]}")
-    
-    builder.button(text="➕ Предложить новую школу", callback_data="new_school")
+    for school_id, name in items:
+        builder.button(text=name, callback_data=f"school_{school_id}")
     builder.adjust(2)
+    if pages > 1:
+        builder.row(
+            InlineKeyboardButton(text="◀️", callback_data=f"schoolpage_{(page - 1) % pages}"),
+            InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"),
+            InlineKeyboardButton(text="▶️", callback_data=f"schoolpage_{(page + 1) % pages}"),
+        )
+    builder.row(InlineKeyboardButton(text="➕ Предложить новую школу", callback_data="new_school"))
     return builder.as_markup()
 
-def create_school_approval_keyboard(user_id, school_name):
+def create_school_approval_keyboard(proposal_id):
     builder = InlineKeyboardBuilder()
-    builder.button(text="✅ Добавить", callback_data=f"approve_{user_id}_{school_name}")
-    builder.button(text="❌ Забанить", callback_data=f"reject_{user_id}")
-    builder.button(text="⏩ Пропустить", callback_data="skip_")
+    builder.button(text="✅ Добавить", callback_data=f"schoolapprove_{proposal_id}")
+    builder.button(text="❌ Забанить", callback_data=f"schoolreject_{proposal_id}")
+    builder.button(text="⏩ Пропустить", callback_data=f"schoolskip_{proposal_id}")
     builder.adjust(2)
     return builder.as_markup()
 
@@ -290,31 +240,12 @@ def create_date_keyboard(user_class, user_school, include_next_lesson_button=Tru
     builder.adjust(1)
     return builder.as_markup()
 
-async def create_subject_keyboard(user_class, user_group=None, day=None, include_all_subjects=True):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT schedule_json FROM schedule WHERE class = ?", (user_class,))
-        result = cur.fetchone()
-        
-        if result:
-            schedule = json.loads(result[0])
-            if day:
-                subjects = schedule.get(day, [])
-            else:
-                subjects = set()
-                for day_subjects in schedule.values():
-                    subjects.update(day_subjects)
-        else:
-            subjects = []
+async def create_subject_keyboard(user_class, user_school, user_group=None, day=None, include_all_subjects=True):
+    weekday = schedules.WEEKDAYS.index(day) if day else None
+    subjects = await schedules.subjects_for(user_class, user_school, user_group, weekday)
     
     builder = InlineKeyboardBuilder()
     for subject in subjects:
-        if "/" in subject:
-            subject_parts = subject.split("/")
-            if user_group:
-                subject = subject_parts[int(user_group) - 1]
-            else:
-                continue
         builder.button(text=subject, callback_data=f"subject_{subject}")
     if include_all_subjects:
         builder.button(text="📚 Все предметы", callback_data="all_subjects")
@@ -330,6 +261,29 @@ def create_day_keyboard():
     builder.adjust(1)
     return builder.as_markup()
 
+def create_search_keyboard(page, has_next):
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"hwpage_{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"hwpage_{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+def create_user_list_keyboard(users, has_next, after_id=0):
+    # Страница результатов поиска в /admin; листается курсором по user_id
+    builder = InlineKeyboardBuilder()
+    for user_id, username, user_class, user_school, role, balance in users:
+        builder.button(text=f"@{username} - {user_class} {user_school} ({role})", callback_data=f"admin_user_{user_id}")
+    builder.adjust(1)
+    buttons = []
+    if after_id:
+        buttons.append(InlineKeyboardButton(text="⏮ В начало", callback_data="usersearch_0"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="▶️ Дальше", callback_data=f"usersearch_{users[-1][0]}"))
+    if buttons:
+        builder.row(*buttons)
+    return builder.as_markup()
+
 def create_admin_user_actions_keyboard():
     builder = InlineKeyboardBuilder()
     builder.button(text="👤 Изменить роль", callback_data="admin_changerole")
@@ -361,21 +315,18 @@ def create_group_selection_keyboard():
 
 
 # Обработчики команд
+SCHOOL_PROMPT = "Выберите свою школу или напишите часть её названия для поиска:"
+
 @router.message(Command("start"), F.chat.type == "private", ~IsBannedFilter())
-async def cmd_start(message: types.Message, state: FSMContext):
+async def cmd_start(message: types.Message, state: FSMContext, profile: Optional[UserProfile]):
     referrer_id = None
     if len(message.text.split()) > 1:
         referrer_id = int(message.text.split()[1])
     
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT class, school FROM users WHERE user_id = ?", (message.from_user.id,))
-        result = cur.fetchone()
-    
-    if result:
-        user_class, user_school = result
+    if profile:
+        user_class, user_school = profile.user_class, profile.school
         if user_school is None:
-            await message.answer("Выберите свою школу:", reply_markup=create_school_keyboard())
+            await message.answer(SCHOOL_PROMPT, reply_markup=await create_school_keyboard())
             await state.set_state(UserState.waiting_for_school)
             return
         
@@ -391,28 +342,22 @@ async def cmd_start(message: types.Message, state: FSMContext):
             "📖 /viewhw – Посмотреть домашку\n\n"
             "✏️ /editschedule – Изменить расписание\n"
             "📅 /viewschedule – Посмотреть расписание\n\n"
+            "🔔 /digest – Домашка на завтра каждый вечер\n"
             "📋 /menu – Информация о пользователе\n"
             "💖 /donate – Поддержать проект",
             reply_markup=create_main_keyboard()
         )
     else:
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("INSERT INTO users (user_id, username, referrer_id) VALUES (?, ?, ?)", 
-                        (message.from_user.id, message.from_user.username, referrer_id))
-            conn.commit()
-        await message.answer("Выберите свою школу:", reply_markup=create_school_keyboard())
+        await db.execute("INSERT INTO users (user_id, username, referrer_id) VALUES (?, ?, ?)", 
+                         (message.from_user.id, message.from_user.username, referrer_id))
+        invalidate_profile(message.from_user.id)
+        await message.answer(SCHOOL_PROMPT, reply_markup=await create_school_keyboard())
         await state.set_state(UserState.waiting_for_school)
 
 @router.message(Command("addhw"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter(), IsEditorOrVipOrAdminFilter())
-async def add_homework(message: types.Message, state: FSMContext):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT class, school FROM users WHERE user_id = ?", (message.from_user.id,))
-        result = cur.fetchone()
-    
-    if result:
-        user_class, user_school = result
+async def add_homework(message: types.Message, state: FSMContext, profile: Optional[UserProfile]):
+    if profile:
+        user_class, user_school = profile.user_class, profile.school
         await state.update_data(user_class=user_class, user_school=user_school)
         await message.answer("Выберите дату:", reply_markup=create_date_keyboard(user_class, user_school))
         await state.set_state(HomeworkState.waiting_for_date)
@@ -420,29 +365,34 @@ async def add_homework(message: types.Message, state: FSMContext):
         await message.answer("Сначала выберите свой класс и школу с помощью команды /start")
 
 @router.message(Command("viewhw"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter())
-async def view_homework(message: types.Message, state: FSMContext):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT class, school FROM users WHERE user_id = ?", (message.from_user.id,))
-        result = cur.fetchone()
-    
-    if result:
-        user_class, user_school = result
+async def view_homework(message: types.Message, state: FSMContext, profile: Optional[UserProfile]):
+    if profile:
+        user_class, user_school = profile.user_class, profile.school
         await state.update_data(user_class=user_class, user_school=user_school)
         await message.answer("Выберите дату:", reply_markup=create_date_keyboard(user_class, user_school, include_next_lesson_button=False))
         await state.set_state(HomeworkState.waiting_for_view_date)
     else:
         await message.answer("Сначала выберите свой класс и школу с помощью команды /start")
 
+async def search_homework_page(profile, query, page):
+    results, has_next = await homework.search(profile.user_class, profile.school, profile.group_number, query, page)
+    return homework.render_search(query, results, page), create_search_keyboard(page, has_next)
+
+@router.message(Command("searchhw"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter())
+async def search_homework(message: types.Message, state: FSMContext, command: CommandObject, profile: Optional[UserProfile]):
+    # /searchhw онегин — сразу ищет, без аргумента бот спрашивает, что искать
+    if command.args:
+        await state.update_data(search_query=command.args.strip())
+        text, keyboard = await search_homework_page(profile, command.args.strip(), 0)
+        await message.answer(text, reply_markup=keyboard)
+    else:
+        await message.answer("🔍 Что найти? Напишите слово из задания или название предмета:")
+        await state.set_state(HomeworkState.waiting_for_search)
+
 @router.message(Command("editschedule"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter(), IsEditorOrVipOrAdminFilter())
-async def edit_schedule(message: types.Message, state: FSMContext):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT class, school FROM users WHERE user_id = ?", (message.from_user.id,))
-        result = cur.fetchone()
-    
-    if result:
-        user_class, user_school = result
+async def edit_schedule(message: types.Message, state: FSMContext, profile: Optional[UserProfile]):
+    if profile:
+        user_class, user_school = profile.user_class, profile.school
         await state.update_data(user_class=user_class, user_school=user_school)
         await message.answer("Выберите день недели для изменения:", reply_markup=create_day_keyboard())
         await state.set_state(ScheduleState.waiting_for_day)
@@ -450,14 +400,9 @@ async def edit_schedule(message: types.Message, state: FSMContext):
         await message.answer("Сначала выберите свой класс и школу с помощью команды /start")
 
 @router.message(Command("viewschedule"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter())
-async def view_schedule(message: types.Message):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT class, school FROM users WHERE user_id = ?", (message.from_user.id,))
-        result = cur.fetchone()
-    
-    if result:
-        user_class, user_school = result
+async def view_schedule(message: types.Message, profile: Optional[UserProfile]):
+    if profile:
+        user_class, user_school = profile.user_class, profile.school
         schedule = await get_schedule(user_class, user_school)
         
         if schedule:
@@ -473,14 +418,9 @@ async def view_schedule(message: types.Message):
         await message.answer("Сначала выберите свой класс и школу с помощью команды /start")
 
 @router.message(Command("menu"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter())
-async def cmd_menu(message: types.Message):
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT class, school, role, balance, referrer_id FROM users WHERE user_id = ?", (message.from_user.id,))
-        result = cur.fetchone()
-    
-    if result:
-        user_class, user_school, role, balance, referrer_id = result
+async def cmd_menu(message: types.Message, profile: Optional[UserProfile]):
+    if profile:
+        user_class, user_school, role, balance = profile.user_class, profile.school, profile.role, profile.balance
         ref_link = f"https://t.me/zmdiarybot?start={message.from_user.id}"
         menu_text = (
             f"📋 *Меню пользователя:*\n\n"
@@ -501,6 +441,39 @@ async def cmd_admin(message: types.Message, state: FSMContext):
     await message.answer("🔍 Введите имя пользователя или Telegram ID для поиска:")
     await state.set_state(AdminPanelState.waiting_for_user_search)
 
+@router.message(Command("stats"), F.chat.type == "private", IsAdminFilter())
+async def cmd_stats(message: types.Message):
+    text = "📊 Кэши:\n"
+    for title, stats in [("Профили", profile_cache_stats()), ("Расписания", schedule_cache_stats()), ("Домашка по дням", homework.view_cache_stats())]:
+        text += (
+            f"\n<b>{title}</b>\n"
+            f"Размер: {stats['size']}/{stats['maxsize']}\n"
+            f"Попадания: {stats['hits']}\n"
+            f"Промахи: {stats['misses']}\n"
+            f"Hit rate: {stats['hit_rate']:.1%}\n"
+            f"Вытеснено: {stats['evictions']}\n"
+            f"Истекло: {stats['expirations']}\n"
+            f"Сброшено: {stats['invalidations']}\n"
+        )
+    stats = notifier.stats()
+    text += (
+        f"\n<b>Рассылка</b>\n"
+        f"В очереди: {stats['queued']}\n"
+        f"Отправлено: {stats['sent']}\n"
+        f"Повторов: {stats['retried']}\n"
+        f"Не доставлено: {stats['failed']}\n"
+        f"Отложено: {stats['deferred']}\n"
+    )
+    stats = throttling.stats()
+    text += (
+        f"\n<b>Ограничение частоты</b>\n"
+        f"Пользователей в памяти: {stats['users']}\n"
+        f"Отклонено: {stats['rejected']}\n"
+    )
+    for command, count in sorted(stats["rejected_by_command"].items(), key=lambda item: -item[1])[:5]:
+        text += f"  {command}: {count}\n"
+    await message.answer(text, parse_mode="HTML")
+
 @router.message(Command("donate"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter())
 async def cmd_donate(message: types.Message):
     donate_text = (
@@ -512,6 +485,16 @@ async def cmd_donate(message: types.Message):
     )
     await message.answer(donate_text, parse_mode="HTML")
 
+@router.message(Command("digest"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter())
+async def cmd_digest(message: types.Message, profile: Optional[UserProfile]):
+    enabled = not profile.digest
+    await db.execute("UPDATE users SET digest = ? WHERE user_id = ?", (enabled, message.from_user.id))
+    invalidate_profile(message.from_user.id)
+    if enabled:
+        await message.answer("🔔 Каждый вечер вы будете получать расписание и домашку на завтра.\nОтключить: /digest")
+    else:
+        await message.answer("🔕 Вечерняя рассылка отключена.\nВключить: /digest")
+
 @router.message(Command("hide"), F.chat.type == "private", ~IsBannedFilter(), HasSchoolAndClassFilter())
 async def cmd_hide(message: types.Message):
     await message.answer("Клавиатура скрыта.", reply_markup=types.ReplyKeyboardRemove())
@@ -520,32 +503,126 @@ async def cmd_hide(message: types.Message):
 
 
 # Планировщики
+EDITOR_ACTIVITY_DAYS = 7
+EDITOR_MIN_HOMEWORK = 4
+EDITOR_MIN_PER_CLASS = 3
+
+def _rotate_editors(conn):
+    cur = conn.cursor()
+    # Чтения и изменения — в одной транзакции: иначе смена роли между запросами
+    # рассинхронизирует список редакторов и editor_counts. IMMEDIATE сразу берёт
+    # блокировку на запись, чтобы обновления в конце не упёрлись в чужой коммит.
+    cur.execute("BEGIN IMMEDIATE")
+    # Активность всех редакторов и число редакторов в каждом классе — двумя агрегатными запросами
+    cur.execute(
+        "SELECT u.user_id, u.school, u.class, COUNT(h.id) FROM users u "
+        "LEFT JOIN homework h ON h.user_id = u.user_id AND h.due_day >= ? "
+        "WHERE u.role = 'editor' GROUP BY u.user_id ORDER BY u.user_id",
+        (dates.today() - EDITOR_ACTIVITY_DAYS,)
+    )
+    editors = cur.fetchall()
+    cur.execute("SELECT school, class, COUNT(*) FROM users WHERE role = 'editor' GROUP BY school, class")
+    editor_counts = {(school, user_class): count for school, user_class, count in cur.fetchall()}
+
+    inactive = {}
+    for user_id, user_school, user_class, hw_count in editors:
+        if hw_count < EDITOR_MIN_HOMEWORK and editor_counts[(user_school, user_class)] > EDITOR_MIN_PER_CLASS:
+            inactive.setdefault((user_school, user_class), []).append(user_id)
+
+    candidates = {}
+    if inactive:
+        cur.execute("SELECT user_id, school, class FROM users WHERE editor_request = TRUE AND role = 'viewer'")
+        for user_id, user_school, user_class in cur.fetchall():
+            if (user_school, user_class) in inactive:
+                candidates.setdefault((user_school, user_class), []).append(user_id)
+
+    demoted = []
+    promoted = []
+    for key, user_ids in inactive.items():
+        editor_count = editor_counts[key]
+        requests = candidates.get(key, [])
+        random.shuffle(requests)
+        for user_id in user_ids:
+            if editor_count <= EDITOR_MIN_PER_CLASS:
+                break
+            demoted.append(user_id)
+            editor_count -= 1
+            if requests:
+                promoted.append(requests.pop())
+                editor_count += 1
+
+    # Условие на текущую роль не даёт перезаписать роль, сменённую вручную
+    demoted = [
+        user_id for user_id in demoted
+        if cur.execute("UPDATE users SET role = 'viewer' WHERE user_id = ? AND role = 'editor'", (user_id,)).rowcount
+    ]
+    promoted = [
+        user_id for user_id in promoted
+        if cur.execute(
+            "UPDATE users SET role = 'editor', editor_request = FALSE WHERE user_id = ? AND role = 'viewer'", (user_id,)
+        ).rowcount
+    ]
+    return len(editors), demoted, promoted
+
 @aiocron.crontab('0 4 * * 6')
 async def check_editors_activity():
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT user_id, class, school FROM users WHERE role = 'editor'")
-        editors = cur.fetchall()
-        
-        for editor in editors:
-            user_id, user_class, user_school = editor
-            cur.execute("SELECT COUNT(*) FROM homework WHERE user_id = ? AND date >= date('now', '-7 days')", (user_id,))
-            hw_count = cur.fetchone()[0]
-            cur.execute("SELECT COUNT(*) FROM users WHERE class = ? AND school = ? AND role = 'editor'", (user_class, user_school))
-            editor_count = cur.fetchone()[0]
-            if hw_count < 4 and editor_count > 3:
-                cur.execute("UPDATE users SET role = 'viewer' WHERE user_id = ?", (user_id,))
-                cur.execute("SELECT user_id FROM users WHERE class = ? AND school = ? AND editor_request = TRUE ORDER BY RANDOM() LIMIT 1", (user_class, user_school))
-                new_editor = cur.fetchone()
-                
-                if new_editor:
-                    new_editor_id = new_editor[0]
-                    cur.execute("UPDATE users SET role = 'editor', editor_request = FALSE WHERE user_id = ?", (new_editor_id,))
-                    await bot.send_message(new_editor_id, "🎉 Поздравляем! Вы стали редактором.")
-        conn.commit()
+    started = time.perf_counter()
+    checked, demoted, promoted = await db.run(_rotate_editors)
+    invalidate_profile(*demoted, *promoted)
+    logging.info(
+        "Проверка редакторов: %d проверено, %d снято, %d назначено за %.2f с",
+        checked, len(demoted), len(promoted), time.perf_counter() - started
+    )
+    # Уведомления ставятся в очередь уже после коммита
+    for new_editor_id in promoted:
+        notifier.send(new_editor_id, "🎉 Поздравляем! Вы стали редактором.")
+
+
+@aiocron.crontab('0 18 * * *')
+async def send_daily_digest():
+    started = time.perf_counter()
+    tomorrow = datetime.now() + timedelta(days=1)
+    subscribers, homework_by_class = await homework.load_digest(tomorrow)
+
+    count = 0
+    for (user_school, user_class), members in subscribers.items():
+        schedule = await schedules.get_compiled(user_class, user_school)
+        subjects = schedule.day(tomorrow.weekday())
+        # Текст собирается один раз на класс и группу, а не на каждого подписчика
+        texts = {}
+        for user_id, user_group in members:
+            if user_group not in texts:
+                rows = homework.for_group(homework_by_class[(user_school, user_class)], user_group)
+                # Завтра нет ни уроков, ни заданий (выходной) — такому классу ничего не шлём
+                texts[user_group] = (
+                    "🌙 На завтра\n\n" + homework.render_day(user_class, tomorrow, subjects, rows)
+                    if subjects or rows else None
+                )
+            if texts[user_group] is None:
+                continue
+            notifier.send(user_id, texts[user_group])
+            count += 1
+    prepared = time.perf_counter() - started
+
+    sent_before = notifier.sent
+    await notifier.join()
+    delivery = time.perf_counter() - started - prepared
+    logging.info(
+        "Рассылка на завтра: %d подписчиков в %d классах, подготовка %.2f с, доставка %.2f с (%.1f сообщений/с)",
+        count, len(subscribers), prepared, delivery, (notifier.sent - sent_before) / delivery if delivery else 0
+    )
 
 
+CRON_JOBS = [check_editors_activity, send_daily_digest]
 
+def start_cron_jobs():
+    # aiocron привязывает задачи к циклу событий, существовавшему при импорте,
+    # а asyncio.run() создаёт новый — перепривязываем к текущему
+    loop = asyncio.get_running_loop()
+    for job in CRON_JOBS:
+        job.stop()
+        job.loop = loop
+        job.start()
 
 
 # Вспомогательные обработчики команд
@@ -577,11 +654,12 @@ async def process_day_selection(callback: types.CallbackQuery, state: FSMContext
     user_class = data.get("user_class")
     user_school = data.get("user_school")
     
-    schedule = await get_schedule(user_class, user_school)
+    schedule = await schedules.get_compiled(user_class, user_school)
+    day_subjects = schedule.day(schedules.WEEKDAYS.index(day))
     text = f"📅 *Текущее расписание на {day}:*\n\n"
     
-    if schedule and day in schedule and schedule[day]:
-        current_schedule = ", ".join(schedule[day])
+    if day_subjects:
+        current_schedule = ", ".join(day_subjects)
         text += f"`{current_schedule}`\n\n"
     else:
         text += "❌ _Расписание отсутствует._\n\n"
@@ -604,7 +682,7 @@ async def process_day_selection(callback: types.CallbackQuery, state: FSMContext
 
 
 @router.callback_query(F.data.startswith("date_"))
-async def process_date_selection(callback: types.CallbackQuery, state: FSMContext):
+async def process_date_selection(callback: types.CallbackQuery, state: FSMContext, profile: Optional[UserProfile]):
     selected_date = callback.data.split("_")[1]
     current_state = await state.get_state()
 
@@ -623,45 +701,22 @@ async def process_date_selection(callback: types.CallbackQuery, state: FSMContex
         await state.update_data(date=selected_date)
         data = await state.get_data()
         user_class = data.get("user_class")
+        user_school = data.get("user_school")
         await callback.message.edit_text(
             f"Вы выбрали дату: {formatted_date}\nВыберите предмет:",
-            reply_markup=create_subject_keyboard(user_class, day=day_of_week)
+            reply_markup=await create_subject_keyboard(user_class, user_school, profile.group_number if profile else None, day=day_of_week)
         )
         await state.set_state(HomeworkState.waiting_for_subject)
 
     elif current_state == HomeworkState.waiting_for_view_date:
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT class, school FROM users WHERE user_id = ?", (callback.from_user.id,))
-            user_data = cur.fetchone()
-            if user_data:
-                user_class, user_school = user_data 
-                date_obj = datetime.strptime(selected_date, "%y %m %d")
-                formatted_date = date_obj.strftime("%d.%m.%Y")
-                days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница"]
-                day_of_week = days[date_obj.weekday()]
-                schedule = await get_schedule(user_class, user_school)
-                if schedule and day_of_week in schedule:
-                    subjects = schedule[day_of_week]
-                else:
-                    subjects = []
-                cur.execute("SELECT subject, task FROM homework WHERE date = ? AND class = ? AND school = ?", 
-                            (selected_date, user_class, user_school))
-                homework_rows = cur.fetchall()
-                text = f"📅 Расписание для {user_class} на ({formatted_date}):\n"
-                if subjects:
-                    text += "\n".join([f"{i+1}. {subject}" for i, subject in enumerate(subjects)])
-                else:
-                    text += "Расписание на этот день отсутствует.\n"
-                text += "\n📚 Домашнее задание:\n"
-                if homework_rows:
-                    text += "\n".join([f"{row[0]}: {row[1]}" for row in homework_rows])
-                else:
-                    text += "Нет заданий на этот день."
-                await callback.message.edit_text(text)
-                await state.clear()
-            else:
-                await callback.message.edit_text("❌ Не удалось найти данные о вашем классе и школе.")
+        if profile:
+            user_class, user_school = profile.user_class, profile.school
+            date_obj = datetime.strptime(selected_date, "%y %m %d")
+            text = await homework.view_day(user_class, user_school, profile.group_number, date_obj)
+            await callback.message.edit_text(text)
+            await state.clear()
+        else:
+            await callback.message.edit_text("❌ Не удалось найти данные о вашем классе и школе.")
     
     await callback.answer()
 
@@ -674,9 +729,10 @@ async def process_date_selection(callback: types.CallbackQuery, state: FSMContex
     await state.update_data(date=formatted_date)
     data = await state.get_data()
     user_class = data.get("user_class")
+    user_school = data.get("user_school")
     await callback.message.edit_text(
         f"Вы выбрали дату: {formatted_date}\nВыберите предмет:",
-        reply_markup=create_subject_keyboard(user_class)
+        reply_markup=await create_subject_keyboard(user_class, user_school)
     )
     await state.set_state(HomeworkState.waiting_for_subject)
     await callback.answer()
@@ -691,7 +747,7 @@ async def process_manual_date(callback: types.CallbackQuery):
     )
 
 @router.message(HomeworkState.waiting_for_view_date, F.text.regexp(r"(\d{2} \d{2} \d{2})|(\d{2} \d{2})"))
-async def process_manual_view_date_input(message: types.Message, state: FSMContext):
+async def process_manual_view_date_input(message: types.Message, state: FSMContext, profile: Optional[UserProfile]):
     try:
         input_date = message.text.strip()
         today = datetime.now()
@@ -707,39 +763,10 @@ async def process_manual_view_date_input(message: types.Message, state: FSMConte
         user_class = data.get("user_class")
         user_school = data.get("user_school")
 
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT group_number FROM users WHERE user_id = ?", (message.from_user.id,))
-            user_group = cur.fetchone()[0]
-            
-            date_obj = datetime.strptime(input_date, "%y %m %d")
-            days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница"]
-            day_of_week = days[date_obj.weekday()]
-            
-            schedule = await get_schedule(user_class, user_school)
-            if schedule and day_of_week in schedule:
-                subjects = schedule[day_of_week]
-            else:
-                subjects = []
-            
-            cur.execute("SELECT subject, task FROM homework WHERE date = ? AND class = ? AND school = ? AND (group_number IS NULL OR group_number = ?)", 
-                        (input_date, user_class, user_school, user_group))
-            homework_rows = cur.fetchall()
-        
-        formatted_date = date_obj.strftime("%d.%m.%Y")
-        
-        text = f"📅 Расписание для {user_class} на ({formatted_date}):\n"
-        if subjects:
-            text += "\n".join([f"{i+1}. {subject}" for i, subject in enumerate(subjects)])
-        else:
-            text += "Расписание на этот день отсутствует.\n"
-        
-        text += "\n📚 Домашнее задание:\n"
-        if homework_rows:
-            text += "\n".join([f"{row[0]}: {row[1]}" for row in homework_rows])
-        else:
-            text += "Нет заданий на этот день."
+        user_group = profile.group_number if profile else None
         
+        date_obj = datetime.strptime(input_date, "%y %m %d")
+        text = await homework.view_day(user_class, user_school, user_group, date_obj)
         await message.answer(text)
         await state.clear()
 
@@ -747,14 +774,36 @@ async def process_manual_view_date_input(message: types.Message, state: FSMConte
         await message.answer("Некорректный формат даты. Используйте ММ ДД (например, 04 15) или ГГ ММ ДД (например, 24 04 15).")
 
 
+@router.message(HomeworkState.waiting_for_search, F.text, ~F.text.startswith("/"))
+async def process_search_input(message: types.Message, state: FSMContext, profile: Optional[UserProfile]):
+    query = message.text.strip()
+    await state.set_state(None)
+    await state.update_data(search_query=query)
+    text, keyboard = await search_homework_page(profile, query, 0)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("hwpage_"))
+async def process_search_page(callback: types.CallbackQuery, state: FSMContext, profile: Optional[UserProfile]):
+    page = int(callback.data.split("_")[1])
+    data = await state.get_data()
+    query = data.get("search_query")
+    if query and profile and profile.user_class and profile.school:
+        text, keyboard = await search_homework_page(profile, query, page)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    else:
+        await callback.message.edit_reply_markup(reply_markup=None)
+        await callback.message.answer("Поиск устарел, повторите его командой /searchhw")
+    await callback.answer()
+
 @router.callback_query(HomeworkState.waiting_for_subject, F.data == "all_subjects")
-async def process_all_subjects(callback: types.CallbackQuery, state: FSMContext):
+async def process_all_subjects(callback: types.CallbackQuery, state: FSMContext, profile: Optional[UserProfile]):
     data = await state.get_data()
     user_class = data.get("user_class")
+    user_school = data.get("user_school")
     
     await callback.message.edit_text(
         "Выберите предмет из всех доступных:",
-        reply_markup=create_subject_keyboard(user_class, include_all_subjects=False)
+        reply_markup=await create_subject_keyboard(user_class, user_school, profile.group_number if profile else None, include_all_subjects=False)
     )
     await callback.answer()
 
@@ -775,18 +824,7 @@ async def process_subject_input(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     subjects = [subject.strip() for subject in message.text.split(",")]
 
-    schedule = await get_schedule(user_class, user_school)
-    if not schedule:
-        schedule = {
-            "Понедельник": [],
-            "Вторник": [],
-            "Среда": [],
-            "Четверг": [],
-            "Пятница": []
-        }
-    
-    schedule[day] = subjects
-    await update_schedule(user_id, user_class, user_school, schedule)
+    await update_schedule(user_id, user_class, user_school, day, subjects)
     await message.reply(f"✅ Расписание на {day} обновлено: {', '.join(subjects)}")
     await state.clear()
 
@@ -798,7 +836,7 @@ async def process_new_subject(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(HomeworkState.waiting_for_task)
-async def process_task_input(message: types.Message, state: FSMContext):
+async def process_task_input(message: types.Message, state: FSMContext, profile: Optional[UserProfile]):
     data = await state.get_data()
     date = data.get("date")
     user_class = data.get("user_class")
@@ -806,61 +844,55 @@ async def process_task_input(message: types.Message, state: FSMContext):
     subject = data.get("subject")
     task = message.text
 
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT group_number FROM users WHERE user_id = ?", (message.from_user.id,))
-        user_group = cur.fetchone()[0]
-        
-        cur.execute("INSERT INTO homework (user_id, date, class, school, subject, task, group_number) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (message.from_user.id, date, user_class, user_school, subject, task, user_group))
-        conn.commit()
+    user_group = profile.group_number if profile else None
+    due_day = dates.parse_day(date)
+    await db.execute("INSERT INTO homework (user_id, date, due_day, class, school, subject, task, group_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (message.from_user.id, date, due_day, user_class, user_school, subject, task, user_group))
+    homework.invalidate_day(user_class, user_school, due_day)
 
     await message.answer(f"✅ Добавлено: {subject} на {date} для {user_class} — {task}")
     await state.clear()
 
-@router.message(ScheduleState.waiting_for_subject)
-async def process_subject_input(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    day = data.get("day")
-    user_class = data.get("user_class")
-    subjects = message.text.split(",")
-
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("DELETE FROM schedule WHERE day = ? AND class = ?", (day, user_class))
-        for subject in subjects:
-            cur.execute("INSERT INTO schedule (user_id, class, day, subject) VALUES (?, ?, ?, ?)", (message.from_user.id, user_class, day, subject.strip()))
-        conn.commit()
-    
-    await message.reply(f"✅ Расписание на {day} обновлено: {', '.join(subjects)}")
-    await state.clear()
-
-
 @router.callback_query(UserState.waiting_for_school, F.data.startswith("school_"))
 async def process_school_selection(callback: types.CallbackQuery, state: FSMContext):
-    school = callback.data.split("_")[1]
+    await schools.ensure_loaded()
+    school_id = callback.data.split("_")[1]
+    # Старые клавиатуры передавали название школы вместо id — такие кнопки просто обновляем
+    school = schools.name_of(int(school_id)) if school_id.isdigit() else None
     
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM schools WHERE name = ?", (school,))
-        result = cur.fetchone()
-        
-        if result:
-            cur.execute("UPDATE users SET school = ? WHERE user_id = ?", (school, callback.from_user.id))
-            conn.commit()
-            await callback.message.edit_text("Выберите свой класс:", reply_markup=create_class_number_keyboard())
-            await state.set_state(UserState.waiting_for_class_number)
-        else:
-            admin_chat_id = ADMIN_CHAT_ID
-            await bot.send_message(
-                admin_chat_id,
-                f"Новое предложение школы:\n\nШкола: {school}\nПользователь: @{callback.from_user.username}\n\nВыберите действие:",
-                reply_markup=create_school_approval_keyboard(callback.from_user.id, school)
-            )
-            await callback.message.edit_text(f"✅ Ваше предложение о добавлении школы '{school}' отправлено на рассмотрение.")
-            await state.clear()
+    if school:
+        await db.execute("UPDATE users SET school = ? WHERE user_id = ?", (school, callback.from_user.id))
+        invalidate_profile(callback.from_user.id)
+        await callback.message.edit_text("Выберите свой класс:", reply_markup=create_class_number_keyboard())
+        await state.set_state(UserState.waiting_for_class_number)
+    else:
+        await callback.message.edit_text(SCHOOL_PROMPT, reply_markup=await create_school_keyboard())
+    await callback.answer()
+
+@router.callback_query(UserState.waiting_for_school, F.data.startswith("schoolpage_"))
+async def process_school_page(callback: types.CallbackQuery, state: FSMContext):
+    page = int(callback.data.split("_")[1])
+    data = await state.get_data()
+    await callback.message.edit_reply_markup(reply_markup=await create_school_keyboard(data.get("school_query"), page))
+    await callback.answer()
+
+@router.callback_query(F.data == "noop")
+async def process_noop(callback: types.CallbackQuery):
+    # Кнопки-подписи вроде счётчика страниц
     await callback.answer()
 
+# Команды во время выбора школы обрабатывают свои обработчики, а не поиск
+@router.message(UserState.waiting_for_school, F.text, ~F.text.startswith("/"))
+async def process_school_search(message: types.Message, state: FSMContext):
+    query = message.text.strip()
+    await state.update_data(school_query=query)
+    await schools.ensure_loaded()
+    if schools.search(query):
+        text = f"🔍 Школы по запросу «{query}»:"
+    else:
+        text = f"🔍 По запросу «{query}» ничего не найдено. Попробуйте другое название или предложите новую школу."
+    await message.answer(text, reply_markup=await create_school_keyboard(query))
+
 @router.callback_query(UserState.waiting_for_school, F.data == "new_school")
 async def process_new_school(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(f"Введите название школы пример:\n«Школа №12».")
@@ -873,49 +905,74 @@ async def process_new_school_input(message: types.Message, state: FSMContext):
     data = await state.get_data()
     user_class = data.get("user_class")
     admin_chat_id = ADMIN_CHAT_ID
-    await bot.send_message(
+    proposal_id = await db.run(_save_school_proposal, message.from_user.id, school_name)
+    notifier.send(
         admin_chat_id,
         f"Новое предложение школы:\n\nШкола: {school_name}\nПользователь: @{message.from_user.username}\n\nВыберите действие:",
-        reply_markup=create_school_approval_keyboard(message.from_user.id, school_name)
+        reply_markup=create_school_approval_keyboard(proposal_id)
     )
     await message.answer(f"✅ Школа «{school_name}» отправлена на модерацию.")
     await state.clear()
 
-@router.callback_query(F.data.startswith("approve_"))
+def _save_school_proposal(conn, user_id, school_name):
+    return conn.execute("INSERT INTO school_proposals (user_id, name) VALUES (?, ?)", (user_id, school_name)).lastrowid
+
+def _take_school_proposal(conn, proposal_id):
+    # Заявка удаляется при первом решении, повторное нажатие кнопки вернёт None
+    row = conn.execute("SELECT user_id, name FROM school_proposals WHERE id = ?", (proposal_id,)).fetchone()
+    if row is not None:
+        conn.execute("DELETE FROM school_proposals WHERE id = ?", (proposal_id,))
+    return row
+
+def _approve_school(conn, proposal_id, username):
+    proposal = _take_school_proposal(conn, proposal_id)
+    if proposal is None:
+        return None
+    user_id, school_name = proposal
+    cur = conn.cursor()
+    cur.execute("INSERT INTO schools (name) VALUES (?)", (school_name,))
+    school_id = cur.lastrowid
+    cur.execute("UPDATE users SET school = ?, username = ? WHERE user_id = ?", 
+                (school_name, username, user_id))
+    return school_id, user_id, school_name
+
+@router.callback_query(F.data.startswith("schoolapprove_"))
 async def process_school_approval(callback: types.CallbackQuery):
-    _, user_id, school_name = callback.data.split("_")
-    user_id = int(user_id)
+    proposal_id = int(callback.data.split("_")[1])
     
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO schools (name) VALUES (?)", (school_name,))
-        cur.execute("UPDATE users SET school = ?, username = ? WHERE user_id = ?", 
-                    (school_name, callback.from_user.username, user_id))
-        conn.commit()
+    approved = await db.run(_approve_school, proposal_id, callback.from_user.username)
+    if approved is None:
+        await callback.answer("Заявка уже обработана.")
+        return
+    school_id, user_id, school_name = approved
+    invalidate_profile(user_id)
+    schools.add_school(school_id, school_name)
     
     await callback.message.edit_text(f"✅ Школа '{school_name}' одобрена и добавлена в список. Пользователь @{callback.from_user.username} теперь может выбрать класс.")
-    await bot.send_message(user_id, f"✅ Школа «{school_name}» одобрена!\n Выберите класс. /start")
+    notifier.send(user_id, f"✅ Школа «{school_name}» одобрена!\n Выберите класс. /start")
     await callback.answer()
 
-@router.callback_query(F.data.startswith("reject_"))
+@router.callback_query(F.data.startswith("schoolreject_"))
 async def process_school_rejection(callback: types.CallbackQuery):
-    _, user_id = callback.data.split("_")
-    user_id = int(user_id)
+    proposal = await db.run(_take_school_proposal, int(callback.data.split("_")[1]))
+    if proposal is None:
+        await callback.answer("Заявка уже обработана.")
+        return
+    user_id, _ = proposal
     
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("UPDATE users SET role = 'ban' WHERE user_id = ?", (user_id,))
-        conn.commit()
+    await db.execute("UPDATE users SET role = 'ban' WHERE user_id = ?", (user_id,))
+    invalidate_profile(user_id)
     
     await callback.message.edit_text(f"❌ Предложение школы отклонено.\nПользователь @{callback.from_user.username} забанен.")
-    await bot.send_message(user_id, "❌ Ваше предложение школы отклонено.")
+    notifier.send(user_id, "❌ Ваше предложение школы отклонено.")
     await callback.answer()
 
-@router.callback_query(F.data == "skip_")
+@router.callback_query(F.data.startswith("schoolskip_"))
 async def process_skip_request(callback: types.CallbackQuery):
+    await db.run(_take_school_proposal, int(callback.data.split("_")[1]))
     message_text = callback.message.text
     username = message_text.split("@")[1].split("\n")[0]
-    await bot.send_message(
+    notifier.send(
         chat_id=callback.from_user.id,
         text=f"❌ Ваша заявка на добавление школы была пропущена."
     )
@@ -926,19 +983,17 @@ async def process_skip_request(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "next_lesson")
-async def process_next_lesson(callback: types.CallbackQuery, state: FSMContext):
+async def process_next_lesson(callback: types.CallbackQuery, state: FSMContext, profile: Optional[UserProfile]):
     data = await state.get_data()
     user_class = data.get("user_class")
     user_school = data.get("user_school")
+    user_group = profile.group_number if profile else None
     today = datetime.now()
-    days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница"]
-    today_day = days[today.weekday()]
-    schedule = await get_schedule(user_class, user_school)
-    if not schedule or today_day not in schedule:
+    subjects = await schedules.subjects_for(user_class, user_school, user_group, today.weekday())
+    if not subjects:
         await callback.answer("❌ На сегодня нет расписания.", show_alert=True)
         return
 
-    subjects = schedule[today_day]
     builder = InlineKeyboardBuilder()
     for subject in subjects:
         builder.button(text=subject, callback_data=f"next_subject_{subject}")
@@ -948,32 +1003,21 @@ async def process_next_lesson(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("next_subject_"))
-async def process_next_subject(callback: types.CallbackQuery, state: FSMContext):
-    subject = callback.data.split("_")[2]
+async def process_next_subject(callback: types.CallbackQuery, state: FSMContext, profile: Optional[UserProfile]):
+    subject = callback.data.split("_", 2)[2]
     data = await state.get_data()
     user_class = data.get("user_class")
     user_school = data.get("user_school")
-    today = datetime.now()
-    days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница"]
-    schedule = await get_schedule(user_class, user_school)
-    if not schedule:
-        await callback.answer("❌ Расписание не найдено.", show_alert=True)
+    user_group = profile.group_number if profile else None
+
+    next_day = await schedules.next_lesson_date(user_class, user_school, subject, user_group, datetime.now())
+    if next_day:
+        next_date = next_day.strftime("%y %m %d")
+        await state.update_data(date=next_date, subject=subject)
+        await callback.message.edit_text(f"Следующий урок по {subject} будет {next_day.strftime('%d.%m.%Y')}.\nВведите задание:")
+        await state.set_state(HomeworkState.waiting_for_task)
+        await callback.answer()
         return
-
-    for i in range(1, 8):
-        next_day = today + timedelta(days=i)
-        next_day_weekday = next_day.weekday()
-        if next_day_weekday >= 5:
-            continue
-
-        next_day_name = days[next_day_weekday]
-        if next_day_name in schedule and subject in schedule[next_day_name]:
-            next_date = next_day.strftime("%y %m %d")
-            await state.update_data(date=next_date, subject=subject)
-            await callback.message.edit_text(f"Следующий урок по {subject} будет {next_day.strftime('%d.%m.%Y')}.\nВведите задание:")
-            await state.set_state(HomeworkState.waiting_for_task)
-            await callback.answer()
-            return
     await callback.answer("❌ Следующий урок по этому предмету не найден.", show_alert=True)
 
 @router.callback_query(HomeworkState.waiting_for_date, F.data == "next_lesson")
@@ -987,7 +1031,7 @@ async def process_next_lesson(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("❌ Сначала выберите предмет.")
         return
    
-    next_lesson_date = find_next_lesson_date(user_class, user_school, subject)
+    next_lesson_date = await find_next_lesson_date(user_class, user_school, subject)
     
     if not next_lesson_date:
         await callback.answer("❌ Следующий урок по этому предмету не найден.")
@@ -999,76 +1043,85 @@ async def process_next_lesson(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
+async def show_found_user(message: types.Message, state: FSMContext, user):
+    user_id, username, user_class, user_school, role, balance = user
+    await state.update_data(user_id=user_id)
+    if role == "admin":
+        await message.answer(
+            f"🔍 Информация о пользователе (админ):\n\n"
+            f"🆔 ID: {user_id}\n"
+            f"👤 Username: @{username}\n"
+            f"🏫 Школа: {user_school}\n"
+            f"🎒 Класс: {user_class}\n"
+            f"👤 Роль: {role}\n"
+            f"💰 Баланс: {balance}\n\n"
+            f"❌ Вы не можете изменять данные другого админа."
+        )
+        await state.clear()
+    else:
+        await message.answer(
+            f"🔍 Найден пользователь:\n\n"
+            f"🆔 ID: {user_id}\n"
+            f"👤 Username: @{username}\n"
+            f"🏫 Школа: {user_school}\n"
+            f"🎒 Класс: {user_class}\n"
+            f"👤 Роль: {role}\n"
+            f"💰 Баланс: {balance}\n\n"
+            f"Выберите действие:",
+            reply_markup=create_admin_user_actions_keyboard()
+        )
+        await state.set_state(AdminPanelState.waiting_for_user_action)
+
 @router.message(AdminPanelState.waiting_for_user_search)
 async def process_user_search(message: types.Message, state: FSMContext):
     search_query = message.text.strip()
     
     try:
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            
-            if search_query.isdigit():
-                cur.execute("SELECT user_id, username, class, school, role, balance FROM users WHERE user_id = ?", (int(search_query),))
-            else:
-                cur.execute("SELECT user_id, username, class, school, role, balance FROM users WHERE user_id IN (SELECT user_id FROM users WHERE class LIKE ? OR school LIKE ? OR username LIKE ?)", 
-                             (f"%{search_query}%", f"%{search_query}%", f"%{search_query}%"))
-            
-            users = cur.fetchall()
+        users, has_next = await search_users(search_query)
         
         if not users:
-            await message.answer("❌ Пользователь не найден.")
+            if len(search_query.lstrip("@")) < USER_SEARCH_MIN_LENGTH:
+                await message.answer(f"❌ Пользователь не найден. Для поиска по классу или школе введите хотя бы {USER_SEARCH_MIN_LENGTH} символа, например «10 А».")
+            else:
+                await message.answer("❌ Пользователь не найден.")
             await state.clear()
             return
         
         if len(users) > 1:
-            builder = InlineKeyboardBuilder()
-            for user in users:
-                user_id, username, user_class, user_school, role, balance = user
-                builder.button(text=f"@{username} - {user_class} {user_school} ({role})", callback_data=f"admin_user_{user_id}")
-            builder.adjust(1)
-            await message.answer("🔍 Найдено несколько пользователей. Выберите одного:", reply_markup=builder.as_markup())
+            await state.update_data(user_query=search_query)
+            await message.answer("🔍 Найдено несколько пользователей. Выберите одного:", reply_markup=create_user_list_keyboard(users, has_next))
         else:
-            user_id, username, user_class, user_school, role, balance = users[0]
-            await state.update_data(user_id=user_id)
-            if role == "admin":
-                await message.answer(
-                    f"🔍 Информация о пользователе (админ):\n\n"
-                    f"🆔 ID: {user_id}\n"
-                    f"👤 Username: @{username}\n"
-                    f"🏫 Школа: {user_school}\n"
-                    f"🎒 Класс: {user_class}\n"
-                    f"👤 Роль: {role}\n"
-                    f"💰 Баланс: {balance}\n\n"
-                    f"❌ Вы не можете изменять данные другого админа."
-                )
-                await state.clear()
-            else:
-                await message.answer(
-                    f"🔍 Найден пользователь:\n\n"
-                    f"🆔 ID: {user_id}\n"
-                    f"👤 Username: @{username}\n"
-                    f"🏫 Школа: {user_school}\n"
-                    f"🎒 Класс: {user_class}\n"
-                    f"👤 Роль: {role}\n"
-                    f"💰 Баланс: {balance}\n\n"
-                    f"Выберите действие:",
-                    reply_markup=create_admin_user_actions_keyboard()
-                )
-                await state.set_state(AdminPanelState.waiting_for_user_action)
+            await show_found_user(message, state, users[0])
     except Exception as e:
         logger.error(f"Ошибка при поиске пользователя: {e}")
         await message.answer("❌ Произошла ошибка при поиске пользователя.")
 
+@router.callback_query(AdminPanelState.waiting_for_user_search, F.data.startswith("usersearch_"))
+async def process_user_search_page(callback: types.CallbackQuery, state: FSMContext):
+    after_id = int(callback.data.split("_")[1])
+    data = await state.get_data()
+    users, has_next = await search_users(data.get("user_query", ""), after_id)
+    if users:
+        await callback.message.edit_reply_markup(reply_markup=create_user_list_keyboard(users, has_next, after_id))
+    await callback.answer()
+
+@router.callback_query(AdminPanelState.waiting_for_user_search, F.data.startswith("admin_user_"))
+async def process_user_pick(callback: types.CallbackQuery, state: FSMContext):
+    user_id = int(callback.data.split("_")[2])
+    user = await db.fetchone("SELECT user_id, username, class, school, role, balance FROM users WHERE user_id = ?", (user_id,))
+    if user:
+        await show_found_user(callback.message, state, user)
+    else:
+        await callback.message.answer("❌ Пользователь не найден.")
+    await callback.answer()
+
 @router.callback_query(AdminPanelState.waiting_for_user_action, F.data.startswith("admin_"))
 async def process_admin_action(callback: types.CallbackQuery, state: FSMContext):
     try:
         action = callback.data.split("_")[1]
         data = await state.get_data()
         user_id = data.get("user_id")
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-            user_role = cur.fetchone()[0]
+        user_role = await db.fetchval("SELECT role FROM users WHERE user_id = ?", (user_id,))
         
         if user_role == "admin":
             await callback.message.edit_text("❌ Вы не можете изменять данные другого админа.")
@@ -1094,19 +1147,14 @@ async def process_role_change(callback: types.CallbackQuery, state: FSMContext):
         data = await state.get_data()
         user_id = data.get("user_id")
         
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-            user_role = cur.fetchone()[0]
+        user_role = await db.fetchval("SELECT role FROM users WHERE user_id = ?", (user_id,))
         
         if user_role == "admin":
             await callback.answer("❌ Вы не можете изменять данные другого администратора.", show_alert=True)
             return
         
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
-            conn.commit()
+        await db.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
+        invalidate_profile(user_id)
         
         await callback.message.edit_text(f"✅ Роль пользователя {user_id} изменена на {role}.")
         await state.clear()
@@ -1123,19 +1171,14 @@ async def process_balance_change(message: types.Message, state: FSMContext):
         data = await state.get_data()
         user_id = data.get("user_id")
         
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-            user_role = cur.fetchone()[0]
+        user_role = await db.fetchval("SELECT role FROM users WHERE user_id = ?", (user_id,))
         
         if user_role == "admin":
             await message.answer("❌ Вы не можете изменять данные другого администратора.")
             return
         
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("UPDATE users SET balance = ? WHERE user_id = ?", (balance, user_id))
-            conn.commit()
+        await db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (balance, user_id))
+        invalidate_profile(user_id)
         
         await message.answer(f"✅ Баланс пользователя {user_id} изменен на {balance}.")
         await state.clear()
@@ -1146,28 +1189,19 @@ async def process_balance_change(message: types.Message, state: FSMContext):
         await message.answer("❌ Произошла ошибка при изменении баланса.")
 
 @router.callback_query(F.data == "request_editor")
-async def process_request_editor(callback: types.CallbackQuery):
-    role = await check_user_role(callback.from_user.id)
+async def process_request_editor(callback: types.CallbackQuery, profile: Optional[UserProfile]):
+    role = check_user_role(profile)
     if role == "ban":
         await callback.answer("❌ Вы забанены и не можете пользоваться ботом.", show_alert=True)
         return
     
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT class, school, editor_request FROM users WHERE user_id = ?", (callback.from_user.id,))
-        result = cur.fetchone()
-    
-    if result:
-        user_class, user_school, editor_request = result
-        
-        if editor_request:
+    if profile:
+        if profile.editor_request:
             await callback.answer("❌ Вы уже подавали заявку на роль редактора.", show_alert=True)
             return
 
-        with sqlite3.connect("homework.db") as conn:
-            cur = conn.cursor()
-            cur.execute("UPDATE users SET editor_request = TRUE WHERE user_id = ?", (callback.from_user.id,))
-            conn.commit()
+        await db.execute("UPDATE users SET editor_request = TRUE WHERE user_id = ?", (callback.from_user.id,))
+        invalidate_profile(callback.from_user.id)
         
         await callback.answer("✅ Ваша заявка на роль редактора отправлена.", show_alert=True)
     else:
@@ -1181,16 +1215,10 @@ async def process_group_selection(callback: types.CallbackQuery, state: FSMConte
     user_class = data.get("user_class")
     school = data.get("school")
     
-    with sqlite3.connect("homework.db") as conn:
-        cur = conn.cursor()
-        cur.execute("UPDATE users SET class = ?, group_number = ?, username = ? WHERE user_id = ?", 
-                    (user_class, group, callback.from_user.username, callback.from_user.id))
-        conn.commit()
-
-    with sqlite3.connect("homework.db") as conn:        
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM schedule WHERE class = ? AND school = ?", (user_class, school))        
-        schedule_count = cur.fetchone()[0]
+    await db.execute("UPDATE users SET class = ?, group_number = ?, username = ? WHERE user_id = ?", 
+                     (user_class, group, callback.from_user.username, callback.from_user.id))
+    invalidate_profile(callback.from_user.id)
+    schedule_count = await db.fetchval("SELECT COUNT(*) FROM schedule WHERE class = ? AND school = ?", (user_class, school), default=0)
     
     if schedule_count == 0:
         await callback.message.edit_text(
@@ -1207,19 +1235,66 @@ async def set_bot_commands(bot: Bot):
 	BotCommand(command="start", description="Запуск бота"),
         BotCommand(command="addhw", description="добавить домашку"),
         BotCommand(command="viewhw", description="посмотреть домашку"),
+        BotCommand(command="searchhw", description="найти задание"),
         BotCommand(command="editschedule", description="изменить расписание"),
         BotCommand(command="viewschedule", description="посмотреть расписание"),
+        BotCommand(command="digest", description="рассылка домашки на завтра"),
         BotCommand(command="menu", description="информация о пользователе"),
         BotCommand(command="donate", description="поддержать проект"),
     ]
     await bot.set_my_commands(commands)
 
-async def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бот для домашних заданий")
+    parser.add_argument("--webhook", action="store_true", help="получать апдейты через вебхук вместо long polling")
+    parser.add_argument("--webhook-url", help="публичный адрес сервера; без него вебхук в Telegram не регистрируется")
+    parser.add_argument("--host", default=webhook.WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=webhook.WEBHOOK_PORT)
+    parser.add_argument("--path", default=webhook.WEBHOOK_PATH)
+    parser.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET"), help="секретный токен вебхука (по умолчанию $WEBHOOK_SECRET)")
+    parser.add_argument("--concurrency", type=int, default=webhook.WEBHOOK_CONCURRENCY, help="сколько апдейтов обрабатывать одновременно")
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_PORT, help="порт /metrics на 127.0.0.1; 0 — не запускать")
+    parser.add_argument("--trace-queries", type=float, metavar="MS", help="логировать запросы дольше MS миллисекунд с планом и периодически выводить самые дорогие")
+    parser.add_argument("--record-updates", metavar="FILE", help="дописывать входящие апдейты в FILE (JSON Lines) для loadtest.py")
+    parser.add_argument("--max-connections", type=int, default=webhook.WEBHOOK_MAX_CONNECTIONS, help="max_connections для setWebhook")
+    return parser.parse_args()
+
+async def main(args):
+    metrics_server = None
+    report = None
+    if args.trace_queries is not None:
+        tracer = querytrace.QueryTracer(args.trace_queries)
+        db.configure(tracer=tracer)
+        report = asyncio.create_task(tracer.report_loop())
     try:
+        await db.run(migrations.migrate)
+        if args.metrics_port:
+            metrics_server = await metrics.start_server(port=args.metrics_port)
+        if args.record_updates:
+            recorder.open(args.record_updates)
+        await notifier.start()
+        start_cron_jobs()
         await set_bot_commands(bot)
-        await dp.start_polling(bot)
+        if args.webhook:
+            if not args.secret:
+                raise ValueError("Для вебхука нужен секретный токен: --secret или WEBHOOK_SECRET")
+            await webhook.run(dp, bot, args.secret, url=args.webhook_url, host=args.host, port=args.port, path=args.path,
+                              concurrency=args.concurrency, max_connections=args.max_connections)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка в основном цикле: {e}")
+    finally:
+        await notifier.stop()
+        await dp.storage.close()
+        recorder.close()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        if report is not None:
+            report.cancel()
+            logger.info(tracer.report())
+        db.shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(parse_args()))
\ No newline at end of file
@@ -0,0 +1,100 @@
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    # Ограниченный по размеру LRU-кэш, записи которого живут не дольше ttl секунд.
+    # Используется только из event loop, поэтому блокировки не нужны.
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # Защита от гонки "промах → чтение из базы → set()": если ключ сбросили, пока
+        # его читали, устаревшее значение не сохраняется. У ключа есть отметка последнего
+        # сброса (или первого version()); у забытых ключей отметка не меньше _floor.
+        self._clock = 0
+        self._floor = 0
+        self._versions = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def version(self, key):
+        # Вызывается перед чтением значения из базы, результат передаётся в set_if_unchanged()
+        if key not in self._versions:
+            self._remember(key, self._floor)
+        return self._versions[key]
+
+    def set_if_unchanged(self, key, value, version):
+        # Сохраняет значение, только если ключ не сбрасывали после version(key)
+        if self._versions.get(key, self._floor) == version:
+            self.set(key, value)
+            return True
+        return False
+
+    def _remember(self, key, stamp):
+        self._versions.pop(key, None)
+        self._versions[key] = stamp
+        while len(self._versions) > self.maxsize:
+            _, oldest = self._versions.popitem(last=False)
+            self._floor = max(self._floor, oldest)
+
+    def invalidate(self, key):
+        self._clock += 1
+        self._remember(key, self._clock)
+        if self._data.pop(key, _MISSING) is not _MISSING:
+            self.invalidations += 1
+
+    def invalidate_where(self, predicate):
+        # Проверяются и ключи, которые сейчас читаются из базы, хотя их ещё нет в кэше
+        for key in {key for key in list(self._data) + list(self._versions) if predicate(key)}:
+            self.invalidate(key)
+
+    def clear(self):
+        self._clock += 1
+        self._floor = self._clock
+        self._versions.clear()
+        self.invalidations += len(self._data)
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,25 @@
+# Кэши профилей, расписаний и домашки живут в памяти процесса. Когда бот запущен
+# несколькими воркерами (supervisor.py), сброс кэша в одном воркере нужно повторить
+# в остальных: функции сброса вызывают publish(), а супервизор рассылает событие
+# соседям, где оно применяется через apply(). В обычном режиме publish() ничего не делает.
+_sink = None
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink
+
+
+def publish(func, *args):
+    if _sink is not None:
+        _sink(func, args)
+
+
+def apply(func, args):
+    # Пришедший от соседа сброс применяется локально и не рассылается повторно
+    global _sink
+    sink, _sink = _sink, None
+    try:
+        func(*args)
+    finally:
+        _sink = sink
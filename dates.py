@@ -0,0 +1,33 @@
+from datetime import date, datetime, timedelta
+
+# Даты домашних заданий хранятся в homework.due_day как номер дня с 1970-01-01:
+# такие значения сортируются и позволяют искать по диапазонам через индекс.
+EPOCH = date(1970, 1, 1)
+
+# Форматы, в которых даты исторически попадали в homework.date
+LEGACY_FORMATS = ("%y %m %d", "%d.%m.%Y")
+
+
+def to_day(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return (value - EPOCH).days
+
+
+def from_day(day):
+    return EPOCH + timedelta(days=day)
+
+
+def today():
+    return to_day(date.today())
+
+
+def parse_day(text):
+    if not text:
+        return None
+    for fmt in LEGACY_FORMATS:
+        try:
+            return to_day(datetime.strptime(text.strip(), fmt))
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,154 @@
+import asyncio
+import contextvars
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import metrics
+
+DB_PATH = "homework.db"
+DB_WORKERS = 4
+
+# Настройки соединений: применяются один раз при открытии соединения
+STATEMENT_CACHE_SIZE = 256
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -32000,  # отрицательное значение — размер в КиБ
+    "temp_store": "MEMORY",
+}
+
+# Все обращения к sqlite выполняются в отдельном пуле потоков,
+# чтобы медленный запрос или заблокированная база не останавливали event loop.
+# Каждый поток пула держит одно долгоживущее соединение.
+_executor = None
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+# Имя обработчика, от которого пришёл запрос (ставит HandlerMetricsMiddleware)
+current_handler = contextvars.ContextVar("current_handler", default=None)
+# Трассировка запросов, см. querytrace.py; включается через configure(tracer=...)
+_tracer = None
+
+
+def connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=PRAGMAS["busy_timeout"] / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    if _tracer is not None:
+        _tracer.install(conn, current_handler)
+    return conn
+
+
+def configure(path=None, workers=None, tracer=None, **pragmas):
+    # Вызывается при старте до первого запроса
+    global DB_PATH, DB_WORKERS, _tracer
+    if _executor is not None:
+        raise RuntimeError("Пул соединений уже запущен")
+    if path is not None:
+        DB_PATH = path
+    if workers is not None:
+        DB_WORKERS = workers
+    if tracer is not None:
+        _tracer = tracer
+    PRAGMAS.update(pragmas)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+    return _executor
+
+
+def _get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def _call(func, *args):
+    conn = _get_connection()
+    try:
+        result = func(conn, *args)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if _tracer is not None:
+            _tracer.finish(conn)
+
+
+async def run(func, *args):
+    # func(conn, *args) выполняется в одной транзакции в потоке пула
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        # Контекст копируется, чтобы в потоке пула был виден current_handler
+        return await loop.run_in_executor(_get_executor(), contextvars.copy_context().run, partial(_call, func, *args))
+    finally:
+        # Обработчик различает запросы через общие fetchone/execute; "-" — задачи по расписанию и фоновые
+        metrics.DB_QUERY_LATENCY.observe(
+            time.perf_counter() - started, current_handler.get() or "-", func.__name__.lstrip("_")
+        )
+
+
+def pending():
+    # Сколько обращений ждут свободного потока пула
+    return _executor._work_queue.qsize() if _executor is not None else 0
+
+
+def _fetchone(conn, query, params):
+    return conn.execute(query, params).fetchone()
+
+
+def _fetchall(conn, query, params):
+    return conn.execute(query, params).fetchall()
+
+
+def _execute(conn, query, params):
+    return conn.execute(query, params).rowcount
+
+
+async def fetchone(query, params=()):
+    return await run(_fetchone, query, params)
+
+
+async def fetchall(query, params=()):
+    return await run(_fetchall, query, params)
+
+
+async def fetchval(query, params=(), default=None):
+    row = await fetchone(query, params)
+    return row[0] if row else default
+
+
+async def execute(query, params=()):
+    return await run(_execute, query, params)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
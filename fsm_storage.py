@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DEFAULT_DESTINY, BaseStorage
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Незавершённые диалоги (/addhw, /editschedule, админка) живут сутки
+STATE_TTL = 24 * 60 * 60
+# Как часто изменения сбрасываются в базу одной транзакцией
+FLUSH_INTERVAL = 1.0
+# Сколько неизменённая запись держится в памяти после последнего обращения
+MEMORY_TTL = 10 * 60
+CLEANUP_INTERVAL = 10 * 60
+
+
+def _key(key):
+    parts = [key.bot_id, key.chat_id, key.user_id]
+    if key.thread_id is not None or key.business_connection_id is not None:
+        parts += [key.thread_id or "", key.business_connection_id or ""]
+    if key.destiny != DEFAULT_DESTINY:
+        parts.append(key.destiny)
+    return ":".join(map(str, parts))
+
+
+def _dump(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else None
+
+
+def _load(conn, key, now):
+    row = conn.execute(
+        "SELECT state, data FROM fsm_state WHERE key = ? AND updated_at > ?", (key, now - STATE_TTL)
+    ).fetchone()
+    if row is None:
+        return None, {}
+    state, data = row
+    return state, json.loads(data) if data else {}
+
+
+def _save(conn, rows, deleted):
+    conn.executemany(
+        "INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+        rows
+    )
+    conn.executemany("DELETE FROM fsm_state WHERE key = ?", [(key,) for key in deleted])
+
+
+def _cleanup(conn, now):
+    return conn.execute("DELETE FROM fsm_state WHERE updated_at <= ?", (now - STATE_TTL,)).rowcount
+
+
+class SQLiteStorage(BaseStorage):
+    # Хранилище FSM в таблице fsm_state. Состояние читается из памяти, а изменения
+    # копятся и раз в FLUSH_INTERVAL записываются в базу одной транзакцией, поэтому
+    # каждый шаг диалога не ждёт записи на диск. После перезапуска диалог продолжается
+    # с последнего сброшенного состояния.
+    # Запись в памяти считается верной до вытеснения и из базы не перечитывается,
+    # поэтому апдейты одного пользователя должен обрабатывать один процесс:
+    # два процесса с общей таблицей перезаписали бы диалоги друг друга.
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._records = {}  # key -> [state, data, touched_at]
+        self._dirty = set()
+        self._flusher = None
+        self._last_cleanup = 0
+        self.flushes = 0
+
+    async def _record(self, key):
+        key = _key(key)
+        record = self._records.get(key)
+        if record is None:
+            state, data = await db.run(_load, key, time.time())
+            # Пока читали из базы, запись могли создать в памяти
+            record = self._records.setdefault(key, [state, data, 0])
+        record[2] = time.monotonic()
+        return key, record
+
+    def _touch(self, key):
+        self._dirty.add(key)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key, state=None):
+        key, record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._touch(key)
+
+    async def get_state(self, key):
+        _, record = await self._record(key)
+        return record[0]
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        key, record = await self._record(key)
+        record[1] = data.copy()
+        self._touch(key)
+
+    async def get_data(self, key):
+        _, record = await self._record(key)
+        return record[1].copy()
+
+    def unflushed(self):
+        return len(self._dirty)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        now = time.time()
+        rows, deleted = [], []
+        for key in dirty:
+            state, data, _ = self._records[key]
+            if state is None and not data:
+                deleted.append(key)
+            else:
+                rows.append((key, state, _dump(data), int(now)))
+        try:
+            await db.run(_save, rows, deleted)
+        except Exception:
+            # Не потеряем изменения: попробуем записать их при следующем сбросе
+            self._dirty |= dirty
+            raise
+        self.flushes += 1
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - MEMORY_TTL
+        for key in [key for key, record in self._records.items() if record[2] < deadline and key not in self._dirty]:
+            del self._records[key]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                self._evict_idle()
+                if time.monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+                    self._last_cleanup = time.monotonic()
+                    removed = await db.run(_cleanup, time.time())
+                    if removed:
+                        logger.info("Удалено заброшенных состояний FSM: %d", removed)
+            except Exception:
+                logger.exception("Не удалось сохранить состояния FSM")
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
@@ -0,0 +1,167 @@
+import re
+
+import cluster
+import db
+import dates
+import schedules
+from cache import TTLCache
+
+VIEW_CACHE_SIZE = 5000
+VIEW_CACHE_TTL = 600
+SEARCH_PAGE_SIZE = 5
+SEARCH_MAX_WORDS = 8
+# Должна совпадать с самым длинным префиксом в homework_fts (prefix='2 3 4 5 6')
+SEARCH_PREFIX_LENGTH = 6
+# Сколько последних совпадений класса ранжируется и листается
+SEARCH_MAX_RESULTS = 200
+# Длинные задания в результатах поиска обрезаются, чтобы страница влезла в одно сообщение
+SEARCH_TASK_PREVIEW = 500
+
+# Готовый текст дня для /viewhw по (school, class, group, due_day).
+# Вместе с текстом хранится версия расписания, по которой он собран: после
+# сохранения расписания запись считается устаревшей даже без явного сброса.
+# Новые задания сбрасывают запись через invalidate_day().
+view_cache = TTLCache(VIEW_CACHE_SIZE, VIEW_CACHE_TTL)
+
+
+def render_day(user_class, date_obj, subjects, homework_rows):
+    # Текст "расписание + домашка" на один день, одинаковый для /viewhw и рассылки
+    formatted_date = date_obj.strftime("%d.%m.%Y")
+    text = f"📅 Расписание для {user_class} на ({formatted_date}):\n"
+    if subjects:
+        text += "\n".join([f"{i+1}. {subject}" for i, subject in enumerate(subjects)])
+    else:
+        text += "Расписание на этот день отсутствует.\n"
+
+    text += "\n📚 Домашнее задание:\n"
+    if homework_rows:
+        text += "\n".join([f"{subject}: {task}" for subject, task in homework_rows])
+    else:
+        text += "Нет заданий на этот день."
+    return text
+
+
+def for_group(homework_rows, user_group):
+    # homework_rows: (subject, task, group_number); задания без группы видны всем
+    return [(subject, task) for subject, task, group in homework_rows if group is None or group == user_group]
+
+
+async def view_day(user_class, user_school, user_group, date_obj):
+    due_day = dates.to_day(date_obj)
+    key = (user_school, user_class, user_group, due_day)
+    schedule = await schedules.get_compiled(user_class, user_school)
+    cached = view_cache.get(key)
+    if cached is not None and cached[0] == schedule.version:
+        return cached[1]
+
+    version = view_cache.version(key)
+    homework_rows = await db.fetchall(
+        "SELECT subject, task FROM homework WHERE due_day = ? AND class = ? AND school = ? "
+        "AND (group_number IS NULL OR group_number = ?)",
+        (due_day, user_class, user_school, user_group)
+    )
+    text = render_day(user_class, date_obj, schedule.day(date_obj.weekday()), homework_rows)
+    # Если во время запроса добавили задание, устаревший текст не кэшируем
+    view_cache.set_if_unchanged(key, (schedule.version, text), version)
+    return text
+
+
+def invalidate_day(user_class, user_school, due_day=None):
+    # Без due_day сбрасываются все дни класса (например, после изменения расписания)
+    view_cache.invalidate_where(
+        lambda key: key[0] == user_school and key[1] == user_class and (due_day is None or key[3] == due_day)
+    )
+    cluster.publish(invalidate_day, user_class, user_school, due_day)
+
+
+def view_cache_stats():
+    return view_cache.stats()
+
+
+def _load_digest(conn, due_day):
+    # Подписчики, сгруппированные по классам, и задания на день одним запросом на класс
+    subscribers = {}
+    rows = conn.execute(
+        "SELECT user_id, school, class, group_number FROM users "
+        "WHERE digest = TRUE AND role != 'ban' AND school IS NOT NULL AND class IS NOT NULL"
+    ).fetchall()
+    for user_id, user_school, user_class, user_group in rows:
+        subscribers.setdefault((user_school, user_class), []).append((user_id, user_group))
+
+    homework = {}
+    for user_school, user_class in subscribers:
+        homework[(user_school, user_class)] = conn.execute(
+            "SELECT subject, task, group_number FROM homework WHERE school = ? AND class = ? AND due_day = ? ORDER BY id",
+            (user_school, user_class, due_day)
+        ).fetchall()
+    return subscribers, homework
+
+
+async def load_digest(date_obj):
+    return await db.run(_load_digest, dates.to_day(date_obj))
+
+
+def query_words(text):
+    # Те же слова, что выделяет токенизатор unicode61: буквы и цифры без "_"
+    return re.findall(r"[^\W_]+", text.lower().replace("ё", "е"))
+
+
+def match_query(words):
+    # Слова ищутся по началу ("онег" найдёт "Онегину"), длинные — по первым SEARCH_PREFIX_LENGTH
+    # буквам: для таких префиксов в homework_fts есть готовый индекс, а окончания в русском
+    # всё равно меняются. Односимвольные слова (номера упражнений) ищутся целиком.
+    # Из запроса берутся только буквы и цифры, поэтому синтаксис FTS5 в него не попадает.
+    terms = [f'"{word[:SEARCH_PREFIX_LENGTH]}"*' if len(word) > 1 else f'"{word}"' for word in words]
+    return "{subject task} : (" + " ".join(terms) + ")"
+
+
+def _score(words, subject, task):
+    # Совпадение в названии предмета весит больше, чем в тексте задания
+    stems = [word[:SEARCH_PREFIX_LENGTH] for word in words]
+    score = 0
+    for weight, text in ((2, subject), (1, task)):
+        for token in query_words(text or ""):
+            score += weight * sum(token.startswith(stem) for stem in stems)
+    return score
+
+
+def _search(conn, user_class, user_school, user_group, match):
+    scope = conn.execute("SELECT id FROM homework_scopes WHERE school = ? AND class = ?", (user_school, user_class)).fetchone()
+    if scope is None:
+        return []
+    return conn.execute(
+        "SELECT h.due_day, h.subject, h.task FROM homework_fts f JOIN homework h ON h.id = f.rowid "
+        "WHERE homework_fts MATCH ? AND (h.group_number IS NULL OR h.group_number = ?) "
+        "ORDER BY f.rowid DESC LIMIT ?",
+        (f"scope : s{scope[0]} AND {match}", user_group, SEARCH_MAX_RESULTS)
+    ).fetchall()
+
+
+async def search(user_class, user_school, user_group, text, page=0, page_size=SEARCH_PAGE_SIZE):
+    # Возвращает (строки страницы, есть ли следующая страница); строки: (date, subject, task).
+    # Совпадения одного класса ранжируются здесь, а не через bm25(): тому для весов слов
+    # нужно пройти их вхождения по всей таблице, а это десятки мс на миллионах заданий.
+    words = query_words(text)[:SEARCH_MAX_WORDS]
+    if not words:
+        return [], False
+    rows = await db.run(_search, user_class, user_school, user_group, match_query(words))
+    rows.sort(key=lambda row: (-_score(words, row[1], row[2]), -(row[0] or 0)))
+    results = [
+        (dates.from_day(due_day) if due_day is not None else None, subject, task)
+        for due_day, subject, task in rows[page * page_size:(page + 1) * page_size]
+    ]
+    return results, len(rows) > (page + 1) * page_size
+
+
+def render_search(query, results, page):
+    if not results:
+        if page:
+            return f"🔍 По запросу «{query}» больше ничего не найдено."
+        return f"🔍 По запросу «{query}» ничего не найдено."
+    lines = [f"🔍 Задания по запросу «{query}», страница {page + 1}:"]
+    for date_obj, subject, task in results:
+        formatted_date = date_obj.strftime("%d.%m.%Y") if date_obj else "без даты"
+        if len(task) > SEARCH_TASK_PREVIEW:
+            task = task[:SEARCH_TASK_PREVIEW] + "…"
+        lines.append(f"\n📅 {formatted_date} — {subject}:\n{task}")
+    return "\n".join(lines)
@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+import db
+import migrations
+import synthetic
+from benchmark import percentile
+from ratelimit import TokenBucket
+
+# Воспроизведение потока апдейтов через dp.feed_update без Telegram: ответы бота
+# уходят в StubSession. Апдейты берутся из файла (записанного bot.py --record-updates
+# или этим скриптом через --save) или генерируются сценариями из synthetic.py.
+LAG_INTERVAL = 0.01
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_updates(path, updates):
+    with open(path, "w", encoding="utf-8") as f:
+        for update in updates:
+            f.write(json.dumps(update, ensure_ascii=False) + "\n")
+
+
+class LoopLagMonitor:
+    # Насколько позже положенного просыпается event loop — показатель того,
+    # что его блокирует синхронная работа
+    def __init__(self, interval=LAG_INTERVAL):
+        self.interval = interval
+        self.samples = []
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - started - self.interval)
+
+
+async def replay(app, updates, rate, concurrency):
+    from aiogram.dispatcher.event.bases import UNHANDLED
+    from aiogram.types import Update
+
+    from middlewares import command_key
+
+    latencies = {}
+    errors = 0
+    # update_id апдейтов, которые не дошли ни до одного обработчика или упали
+    failed = set()
+
+    async def lane(queue):
+        nonlocal errors
+        while True:
+            raw = await queue.get()
+            update = Update.model_validate(raw, context={"bot": app.bot})
+            started = time.perf_counter()
+            try:
+                if await app.dp.feed_update(app.bot, update) is UNHANDLED:
+                    failed.add(update.update_id)
+            except Exception:
+                errors += 1
+                failed.add(update.update_id)
+            finally:
+                latencies.setdefault(command_key(update), []).append(time.perf_counter() - started)
+                queue.task_done()
+
+    # Апдейты одного пользователя идут в одну полосу, поэтому диалоги не перемешиваются
+    lanes = [asyncio.Queue() for _ in range(concurrency)]
+    workers = [asyncio.create_task(lane(queue)) for queue in lanes]
+    bucket = TokenBucket(rate, max(1, rate / 10)) if rate else None
+    monitor = LoopLagMonitor()
+    monitor_task = asyncio.create_task(monitor.run())
+
+    from supervisor import update_user_id
+
+    started = time.perf_counter()
+    for raw in updates:
+        if bucket is not None:
+            delay = bucket.take()
+            if delay:
+                await asyncio.sleep(delay)
+        lanes[update_user_id(raw) % concurrency].put_nowait(raw)
+    for queue in lanes:
+        await queue.join()
+    elapsed = time.perf_counter() - started
+
+    for task in workers + [monitor_task]:
+        task.cancel()
+    return elapsed, latencies, errors, monitor.samples, failed
+
+
+async def incomplete_flows(app, scripts, failed):
+    # Сценарий не завершён, если какой-то его шаг не был обработан
+    # или после последнего шага у пользователя остался незакрытый диалог
+    from aiogram.fsm.storage.base import StorageKey
+
+    from supervisor import update_user_id
+
+    incomplete = 0
+    for script in scripts:
+        user_id = update_user_id(script[-1])
+        key = StorageKey(bot_id=app.bot.id, chat_id=user_id, user_id=user_id)
+        if any(raw["update_id"] in failed for raw in script) or await app.dp.storage.get_state(key) is not None:
+            incomplete += 1
+    return incomplete
+
+
+def report(elapsed, latencies, errors, lag, throttled):
+    total = sum(len(values) for values in latencies.values())
+    print(f"Апдейтов: {total} за {elapsed:.2f} с, {total / elapsed:.0f} апдейтов/с, ошибок: {errors}, отклонено ограничением частоты: {throttled}")
+    print(f"{'команда':20} {'кол-во':>8} {'в сек':>8} {'p50 мс':>9} {'p99 мс':>9} {'макс мс':>9}")
+    for command, values in sorted(latencies.items(), key=lambda item: -len(item[1])):
+        values.sort()
+        print(f"{command:20} {len(values):>8} {len(values) / elapsed:>8.1f} {percentile(values, 0.5) * 1000:>9.2f} "
+              f"{percentile(values, 0.99) * 1000:>9.2f} {values[-1] * 1000:>9.2f}")
+    lag.sort()
+    if lag:
+        print(f"Задержка event loop: p50 {percentile(lag, 0.5) * 1000:.2f} мс, p99 {percentile(lag, 0.99) * 1000:.2f} мс, "
+              f"макс {lag[-1] * 1000:.2f} мс")
+
+
+async def main(args):
+    if os.path.exists(args.db) and not args.reuse:
+        raise SystemExit(f"{args.db} уже существует: удалите его или запустите с --reuse")
+    db.configure(path=args.db)
+    # Модуль бота создаёт Bot при импорте, поэтому импортируется после configure()
+    import bot as app
+
+    app.bot.session = synthetic.StubSession()
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    try:
+        await db.run(migrations.migrate)
+        if not args.reuse:
+            await db.run(synthetic.seed_scale, args.schools, args.classes, args.users_per_class, args.homework)
+
+        scripts = None
+        if args.updates:
+            updates = load_updates(args.updates)
+        else:
+            scripts = synthetic.conversations(args.schools, args.classes, args.users_per_class,
+                                              args.new_users, args.editors, args.viewers)
+            updates = list(synthetic.interleave(scripts))
+        if args.save:
+            save_updates(args.save, updates)
+
+        await app.notifier.start(restore=False)
+        elapsed, latencies, errors, lag, failed = await replay(app, updates, args.rate, args.concurrency)
+        report(elapsed, latencies, errors, lag, app.throttling.rejected)
+        print(f"Необработанных апдейтов: {len(failed)}")
+        if scripts is not None:
+            print(f"Незавершённых сценариев: {await incomplete_flows(app, scripts, failed)} из {len(scripts)}")
+    finally:
+        await app.notifier.stop(timeout=1)
+        await app.dp.storage.close()
+        db.shutdown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочное воспроизведение апдейтов без Telegram")
+    parser.add_argument("--updates", metavar="FILE", help="апдейты в JSON Lines; без него генерируются сценарии")
+    parser.add_argument("--save", metavar="FILE", help="сохранить воспроизводимые апдейты в FILE")
+    parser.add_argument("--rate", type=float, default=0, help="апдейтов в секунду (0 — без ограничения)")
+    parser.add_argument("--concurrency", type=int, default=64, help="сколько пользователей обслуживается одновременно")
+    parser.add_argument("--db", default="loadtest_homework.db", help="временная база; существующая используется только с --reuse")
+    parser.add_argument("--reuse", action="store_true", help="не заполнять базу, взять уже созданную")
+    parser.add_argument("--schools", type=int, default=100)
+    parser.add_argument("--classes", type=int, default=1000)
+    parser.add_argument("--users-per-class", type=int, default=30)
+    parser.add_argument("--homework", type=int, default=100000)
+    parser.add_argument("--new-users", type=int, default=200, help="сколько пользователей проходят регистрацию")
+    parser.add_argument("--editors", type=int, default=200, help="сколько редакторов добавляют домашку")
+    parser.add_argument("--viewers", type=int, default=2000, help="сколько учеников смотрят домашку на завтра")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,128 @@
+import bisect
+import logging
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Метрики в формате Prometheus без сторонних зависимостей.
+# Значения обновляются только из event loop, поэтому обходятся без блокировок:
+# наблюдение — это поиск в словаре по кортежу меток и пара сложений.
+REGISTRY = []
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge:
+    # Значение считывается в момент запроса: func() возвращает число
+    # или словарь {кортеж значений меток: число}
+    def __init__(self, name, documentation, func, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._children = {}  # метки -> [счётчики по корзинам, сумма, количество]
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        child[0][bisect.bisect_left(self.buckets, value)] += 1
+        child[1] += value
+        child[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self._children.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_LATENCY = Histogram("bot_handler_duration_seconds", "Время работы обработчика", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+FILTER_REJECTIONS = Counter("bot_filter_rejections_total", "Апдейты, не прошедшие фильтр доступа", ("filter",))
+DB_QUERY_LATENCY = Histogram(
+    "bot_db_query_duration_seconds", "Время обращения к базе с учётом ожидания пула", ("handler", "operation")
+)
+API_LATENCY = Histogram("bot_api_request_duration_seconds", "Время запроса к Telegram Bot API", ("method",))
+THROTTLED = Counter("bot_throttled_total", "Апдейты, отклонённые ограничением частоты", ("command",))
+API_ERRORS = Counter("bot_api_errors_total", "Ошибки запросов к Telegram Bot API", ("method", "error"))
+
+
+async def _handle(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    return runner
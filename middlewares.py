@@ -0,0 +1,180 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+
+import db
+import metrics
+import users
+from ratelimit import TokenBucket
+
+# Лимиты на пользователя: (токенов в секунду, размер пачки)
+USER_LIMIT = (3, 10)
+COMMAND_LIMIT = (1, 4)
+COMMAND_LIMITS = {
+    "viewhw": (0.5, 3),
+    "addhw": (0.5, 3),
+    "searchhw": (0.5, 3),
+}
+# Ведра пользователя, который не писал столько секунд, уже полные — их можно забыть
+THROTTLE_IDLE_TTL = 60
+THROTTLE_MAX_USERS = 100000
+
+
+class UserProfileMiddleware(BaseMiddleware):
+    # Загружает строку пользователя один раз на апдейт и кладёт её в data["profile"],
+    # чтобы фильтры и обработчики не ходили в базу повторно.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        data["profile"] = await users.load_profile(user.id) if user else None
+        return await handler(event, data)
+
+
+def command_key(update: Update):
+    # Ключ для лимита на команду: "/viewhw" -> "viewhw", "date_24 05 14" -> "date"
+    if update.message and update.message.text and update.message.text.startswith("/"):
+        return update.message.text.split()[0][1:].split("@")[0]
+    if update.callback_query and update.callback_query.data:
+        return update.callback_query.data.split("_")[0]
+    return update.event_type
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Ограничивает частоту апдейтов от одного пользователя и одной команды.
+    # Регистрируется раньше UserProfileMiddleware: отклонённый апдейт не доходит до базы.
+    # Пользователи хранятся в OrderedDict в порядке последнего обращения,
+    # поэтому давно неактивные вытесняются с начала за O(1) на каждого.
+    def __init__(self):
+        self._users = OrderedDict()  # user_id -> (ведро пользователя, {команда: ведро})
+        self.rejected = 0
+        self.rejected_by_command = {}
+        self.evicted = 0
+
+    def _evict(self, now):
+        while self._users:
+            user_id, (bucket, _) = next(iter(self._users.items()))
+            if len(self._users) <= THROTTLE_MAX_USERS and now - bucket.updated < THROTTLE_IDLE_TTL:
+                break
+            del self._users[user_id]
+            self.evicted += 1
+
+    def _allow(self, user_id, command):
+        now = time.monotonic()
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = (TokenBucket(*USER_LIMIT), {})
+        else:
+            self._users.move_to_end(user_id)
+        self._evict(now)
+
+        user_bucket, commands = entry
+        if command is None:
+            return user_bucket.try_take()
+        command_bucket = commands.get(command)
+        if command_bucket is None:
+            command_bucket = commands[command] = TokenBucket(*COMMAND_LIMITS.get(command, COMMAND_LIMIT))
+        return command_bucket.try_take() and user_bucket.try_take()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        command = command_key(event)
+        # Текст внутри диалога (задание в /addhw, запрос поиска) продолжает уже
+        # пропущенную команду, поэтому на него действует только лимит пользователя
+        dialog_input = event.message is not None and data.get("raw_state") is not None and command == "message"
+        if self._allow(user.id, None if dialog_input else command):
+            return await handler(event, data)
+
+        self.rejected += 1
+        self.rejected_by_command[command] = self.rejected_by_command.get(command, 0) + 1
+        metrics.THROTTLED.inc(command)
+        if event.callback_query:
+            # Без ответа на callback у пользователя крутятся "часики" на кнопке
+            await event.callback_query.answer("⏳ Слишком часто, подождите немного.")
+        elif dialog_input:
+            # Иначе введённый текст молча теряется, а диалог ждёт его дальше
+            await event.message.answer("⏳ Слишком часто, подождите немного и отправьте сообщение ещё раз.")
+        return None
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "rejected_by_command": dict(self.rejected_by_command),
+        }
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Внутренний middleware роутера: вызывается только для апдейтов, прошедших фильтры,
+    # и знает, какой обработчик выбран
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        token = db.current_handler.set(name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            metrics.HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+            db.current_handler.reset(token)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    # Время и ошибки исходящих запросов к Bot API, подключается к bot.session
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            metrics.API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.API_LATENCY.observe(time.perf_counter() - started, name)
+
+
+class UpdateRecorder(BaseMiddleware):
+    # Дописывает каждый входящий апдейт строкой JSON, чтобы потом воспроизвести
+    # поток через loadtest.py. Регистрируется первым и ничего не делает, пока не вызван open().
+    def __init__(self):
+        self._file = None
+
+    def open(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self._file is not None:
+            self._file.write(event.model_dump_json(exclude_unset=True) + "\n")
+        return await handler(event, data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,329 @@
+import json
+import logging
+import time
+
+from dates import parse_day
+from schedules import WEEKDAYS, lesson_rows
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Упорядоченный список миграций. Номер миграции — её позиция в списке (с 1),
+# применённая версия хранится в PRAGMA user_version. Миграции должны быть
+# идемпотентными: прерванный запуск просто повторит последнюю из них.
+MIGRATIONS = []
+
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+
+def backfill(conn, select_sql, apply, batch_size=BACKFILL_BATCH_SIZE):
+    # Обрабатывает большую таблицу пачками и коммитит после каждой,
+    # чтобы не держать блокировку на запись всё время миграции.
+    # select_sql получает (последний id, размер пачки), первая колонка — id:
+    # "SELECT id, ... FROM t WHERE id > ? ORDER BY id LIMIT ?"
+    last_id = 0
+    total = 0
+    while True:
+        rows = conn.execute(select_sql, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        apply(conn, rows)
+        conn.commit()
+        last_id = rows[-1][0]
+        total += len(rows)
+    return total
+
+
+@migration
+def create_base_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS homework (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    date TEXT,
+                    group_number TEXT,
+                    class TEXT,
+                    school TEXT,
+                    subject TEXT,
+                    task TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    class TEXT,
+                    school TEXT,
+                    group_number TEXT,
+                    role TEXT DEFAULT 'viewer',
+                    balance INTEGER DEFAULT 0,
+                    referrer_id INTEGER DEFAULT NULL,
+                    editor_request BOOLEAN DEFAULT FALSE)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS schedule (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    class TEXT,
+                    school TEXT,
+                    schedule_json TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS schools (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE)''')
+
+
+@migration
+def add_query_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_homework_class_date ON homework (school, class, date, group_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_homework_user_date ON homework (user_id, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_class_role ON users (school, class, role)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)")
+    # Старые базы могли накопить дубли расписаний одного класса — оставляем последнее
+    conn.execute('''DELETE FROM schedule WHERE id NOT IN (
+                    SELECT MAX(id) FROM schedule GROUP BY school, class)''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_schedule_class ON schedule (school, class)")
+
+
+@migration
+def normalize_schedule(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS lessons (
+                    id INTEGER PRIMARY KEY,
+                    school TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    weekday INTEGER NOT NULL,
+                    slot INTEGER NOT NULL,
+                    group_number INTEGER,
+                    subject TEXT NOT NULL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lessons_day ON lessons (school, class, weekday, slot)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lessons_subject ON lessons (school, class, subject, group_number, weekday)")
+
+    def apply(conn, rows):
+        for _, user_class, user_school, schedule_json in rows:
+            conn.execute("DELETE FROM lessons WHERE school = ? AND class = ?", (user_school, user_class))
+            schedule = json.loads(schedule_json)
+            for day, subjects in schedule.items():
+                if day not in WEEKDAYS:
+                    logger.warning("Пропущен неизвестный день %r в расписании %s (%s)", day, user_class, user_school)
+                    continue
+                conn.executemany(
+                    "INSERT INTO lessons (school, class, weekday, slot, group_number, subject) VALUES (?, ?, ?, ?, ?, ?)",
+                    lesson_rows(user_school, user_class, WEEKDAYS.index(day), subjects)
+                )
+
+    # schedule остаётся заголовком расписания класса, schedule_json больше не читается
+    count = backfill(
+        conn,
+        "SELECT id, class, school, schedule_json FROM schedule "
+        "WHERE id > ? AND schedule_json IS NOT NULL ORDER BY id LIMIT ?",
+        apply
+    )
+    logger.info("Перенесено расписаний в lessons: %d", count)
+
+
+@migration
+def add_schedule_version(conn):
+    if not _has_column(conn, "schedule", "version"):
+        conn.execute("ALTER TABLE schedule ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+@migration
+def add_homework_due_day(conn):
+    if not _has_column(conn, "homework", "due_day"):
+        conn.execute("ALTER TABLE homework ADD COLUMN due_day INTEGER")
+
+    def apply(conn, rows):
+        conn.executemany(
+            "UPDATE homework SET due_day = ? WHERE id = ?",
+            [(parse_day(date), homework_id) for homework_id, date in rows]
+        )
+
+    count = backfill(
+        conn,
+        "SELECT id, date FROM homework WHERE id > ? AND due_day IS NULL ORDER BY id LIMIT ?",
+        apply
+    )
+    unparsed = conn.execute("SELECT COUNT(*) FROM homework WHERE due_day IS NULL").fetchone()[0]
+    logger.info("Проверено заданий: %d, не распознано дат: %d", count, unparsed)
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_homework_class_day ON homework (school, class, due_day, group_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_homework_user_day ON homework (user_id, due_day)")
+    conn.execute("DROP INDEX IF EXISTS idx_homework_class_date")
+    conn.execute("DROP INDEX IF EXISTS idx_homework_user_date")
+
+
+@migration
+def add_editor_request_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_editor_request ON users (school, class) WHERE editor_request = TRUE")
+
+
+@migration
+def create_outbox(conn):
+    # Сообщения, которые не удалось доставить до остановки бота, см. notifier.py
+    conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY,
+                    chat_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    reply_markup TEXT,
+                    parse_mode TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL)''')
+
+
+@migration
+def add_digest_subscription(conn):
+    if not _has_column(conn, "users", "digest"):
+        conn.execute("ALTER TABLE users ADD COLUMN digest BOOLEAN NOT NULL DEFAULT FALSE")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_digest ON users (school, class) WHERE digest = TRUE")
+
+
+@migration
+def create_fsm_state(conn):
+    # Состояния диалогов, см. fsm_storage.py
+    conn.execute('''CREATE TABLE IF NOT EXISTS fsm_state (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    updated_at INTEGER NOT NULL) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state (updated_at)")
+
+
+# Выражения, которыми текст задания попадает в полнотекстовый индекс. Триггер удаления
+# должен передать ровно те же значения, что были вставлены, поэтому они общие.
+# unicode61 не сводит "ё" к "е" — делаем это сами, запрос нормализуется так же.
+_FTS_VALUES = '''{row}.id,
+                 replace(replace({row}.subject, 'ё', 'е'), 'Ё', 'Е'),
+                 replace(replace({row}.task, 'ё', 'е'), 'Ё', 'Е'),
+                 's' || (SELECT id FROM homework_scopes WHERE school = {row}.school AND class = {row}.class)'''
+
+
+@migration
+def create_homework_search(conn):
+    # Поиск по заданиям для /searchhw, см. homework.search().
+    # homework_fts не хранит текст (content=''), только индекс; строки берутся из homework по rowid.
+    # Класс задаётся одним токеном "s<id>" в колонке scope: в запросе он пересекается
+    # с найденными словами внутри индекса, и поиск не зависит от размера всей таблицы.
+    conn.execute('''CREATE TABLE IF NOT EXISTS homework_scopes (
+                    id INTEGER PRIMARY KEY,
+                    school TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    UNIQUE (school, class))''')
+    # Индекс пересобирается целиком, чтобы прерванная миграция не оставила дублей
+    for trigger in ("homework_fts_insert", "homework_fts_delete", "homework_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS homework_fts")
+    conn.execute('''CREATE VIRTUAL TABLE homework_fts USING fts5(
+                    subject, task, scope,
+                    content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5 6')''')
+
+    conn.execute(
+        "INSERT OR IGNORE INTO homework_scopes (school, class) "
+        "SELECT DISTINCT school, class FROM homework WHERE school IS NOT NULL AND class IS NOT NULL"
+    )
+
+    def apply(conn, rows):
+        conn.execute(
+            f"INSERT INTO homework_fts (rowid, subject, task, scope) "
+            f"SELECT {_FTS_VALUES.format(row='h')} FROM homework h WHERE h.id BETWEEN ? AND ?",
+            (rows[0][0], rows[-1][0])
+        )
+
+    count = backfill(conn, "SELECT id FROM homework WHERE id > ? ORDER BY id LIMIT ?", apply)
+    logger.info("Проиндексировано заданий для поиска: %d", count)
+
+    scope_insert = '''INSERT OR IGNORE INTO homework_scopes (school, class)
+                      SELECT new.school, new.class WHERE new.school IS NOT NULL AND new.class IS NOT NULL;'''
+    index_delete = f'''INSERT INTO homework_fts (homework_fts, rowid, subject, task, scope)
+                       VALUES ('delete', {_FTS_VALUES.format(row='old')});'''
+    index_insert = f'''INSERT INTO homework_fts (rowid, subject, task, scope)
+                       VALUES ({_FTS_VALUES.format(row='new')});'''
+    conn.execute(f"CREATE TRIGGER homework_fts_insert AFTER INSERT ON homework BEGIN {scope_insert} {index_insert} END")
+    conn.execute(f"CREATE TRIGGER homework_fts_delete AFTER DELETE ON homework BEGIN {index_delete} END")
+    conn.execute(
+        f"CREATE TRIGGER homework_fts_update AFTER UPDATE OF subject, task, school, class ON homework "
+        f"BEGIN {index_delete} {scope_insert} {index_insert} END"
+    )
+
+
+@migration
+def create_user_search(conn):
+    # Поиск пользователей в /admin, см. users.search_users().
+    # @username ищется точно по индексу без учёта регистра, остальное — по подстроке
+    # в username, классе и школе через триграммный индекс поверх users.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+    for trigger in ("users_fts_insert", "users_fts_delete", "users_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS users_fts")
+    conn.execute('''CREATE VIRTUAL TABLE users_fts USING fts5(
+                    username, class, school,
+                    content='users', content_rowid='user_id', tokenize='trigram')''')
+
+    def apply(conn, rows):
+        conn.execute(
+            "INSERT INTO users_fts (rowid, username, class, school) "
+            "SELECT user_id, username, class, school FROM users WHERE user_id BETWEEN ? AND ?",
+            (rows[0][0], rows[-1][0])
+        )
+
+    count = backfill(conn, "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", apply)
+    logger.info("Проиндексировано пользователей для поиска: %d", count)
+
+    index_delete = '''INSERT INTO users_fts (users_fts, rowid, username, class, school)
+                      VALUES ('delete', old.user_id, old.username, old.class, old.school);'''
+    index_insert = '''INSERT INTO users_fts (rowid, username, class, school)
+                      VALUES (new.user_id, new.username, new.class, new.school);'''
+    conn.execute(f"CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN {index_insert} END")
+    conn.execute(f"CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN {index_delete} END")
+    # Роль, баланс и подписка меняются часто — индекс трогаем только при смене полей поиска
+    conn.execute(
+        f"CREATE TRIGGER users_fts_update AFTER UPDATE OF username, class, school ON users "
+        f"BEGIN {index_delete} {index_insert} END"
+    )
+
+
+@migration
+def replace_editor_request_index(conn):
+    # Индекс по (school, class) проигрывал idx_users_role: выборка кандидатов
+    # в _rotate_editors фильтрует по роли и читала всех зрителей.
+    # Роль первой колонкой — и запрос целиком покрывается частичным индексом.
+    conn.execute("DROP INDEX IF EXISTS idx_users_editor_request")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_editor_candidates ON users (role, school, class) "
+        "WHERE editor_request = TRUE"
+    )
+
+
+@migration
+def create_school_proposals(conn):
+    # Предложенные пользователями школы ждут решения администратора.
+    # В кнопки уходит только id заявки: название не влезает в 64 байта callback_data.
+    conn.execute('''CREATE TABLE IF NOT EXISTS school_proposals (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    name TEXT NOT NULL)''')
+
+
+def _has_column(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    current = get_version(conn)
+    target = len(MIGRATIONS)
+    if current > target:
+        raise RuntimeError(f"Версия базы {current} новее, чем известные миграции ({target})")
+
+    started = time.perf_counter()
+    for version, func in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        step_started = time.perf_counter()
+        func(conn)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        logger.info("Миграция %d (%s) применена за %.3f с", version, func.__name__, time.perf_counter() - step_started)
+
+    if current < target:
+        logger.info("База обновлена с версии %d до %d за %.3f с", current, target, time.perf_counter() - started)
+    return target
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import InlineKeyboardMarkup
+
+import db
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+PER_CHAT_BURST = 3
+WORKERS = 8
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+CHAT_BUCKETS_LIMIT = 10000
+
+
+@dataclass
+class Notification:
+    chat_id: int
+    text: str
+    reply_markup: InlineKeyboardMarkup = None
+    parse_mode: str = None
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+
+
+class Notifier:
+    # Очередь исходящих сообщений. Обработчики и задачи по расписанию вызывают send()
+    # и не ждут Telegram; доставкой с учётом лимитов занимаются воркеры.
+    def __init__(self, bot, workers=WORKERS, global_rate=GLOBAL_RATE):
+        # При нескольких процессах бота global_rate делится между ними
+        self.bot = bot
+        self.workers = workers
+        self._queue = asyncio.Queue()
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._tasks = []
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.deferred = 0
+
+    def send(self, chat_id, text, reply_markup=None, parse_mode=None):
+        self._queue.put_nowait(Notification(chat_id, text, reply_markup, parse_mode))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "deferred": self.deferred,
+        }
+
+    async def start(self, restore=True):
+        # restore=False — outbox забирает другой процесс
+        for item in await db.run(_take_outbox) if restore else []:
+            self._queue.put_nowait(item)
+        if self._queue.qsize():
+            logger.info("Загружено неотправленных сообщений: %d", self._queue.qsize())
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def join(self):
+        await self._queue.join()
+
+    async def stop(self, timeout=5):
+        # Даём очереди разойтись, остальное сохраняем в outbox до следующего запуска
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+            self._queue.task_done()
+        if pending:
+            await self._defer(pending)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= CHAT_BUCKETS_LIMIT:
+                now = time.monotonic()
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._deliver(item)
+            except asyncio.CancelledError:
+                # Остановка во время отправки или ожидания повтора — stop() сохранит сообщение
+                self._queue.put_nowait(item)
+                raise
+            except Exception:
+                logger.exception("Ошибка при отправке сообщения в чат %s", item.chat_id)
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, item):
+        delay = max(self._chat_bucket(item.chat_id).take(), self._global.take())
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            await self.bot.send_message(item.chat_id, item.text, reply_markup=item.reply_markup, parse_mode=item.parse_mode)
+            self.sent += 1
+        except TelegramRetryAfter as e:
+            item.attempts += 1
+            self.retried += 1
+            await self._retry(item, e.retry_after)
+        except (TelegramNetworkError, TelegramServerError):
+            item.attempts += 1
+            self.retried += 1
+            await self._retry(item, min(BACKOFF_BASE * 2 ** item.attempts, BACKOFF_MAX))
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Пользователь заблокировал бота или сообщение некорректно — повтор не поможет
+            logger.warning("Сообщение в чат %s не доставлено: %s", item.chat_id, e)
+            self.failed += 1
+
+    async def _retry(self, item, delay):
+        if item.attempts >= MAX_ATTEMPTS:
+            await self._defer([item])
+            return
+        await asyncio.sleep(delay)
+        self._queue.put_nowait(item)
+
+    async def _defer(self, items):
+        await db.run(_save_outbox, items)
+        self.deferred += len(items)
+        logger.warning("Отложено неотправленных сообщений: %d", len(items))
+
+
+def _save_outbox(conn, items):
+    conn.executemany(
+        "INSERT INTO outbox (chat_id, text, reply_markup, parse_mode, attempts, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                item.chat_id,
+                item.text,
+                item.reply_markup.model_dump_json(exclude_none=True) if item.reply_markup else None,
+                item.parse_mode,
+                item.attempts,
+                item.created_at,
+            )
+            for item in items
+        ]
+    )
+
+
+def _take_outbox(conn):
+    rows = conn.execute(
+        "SELECT chat_id, text, reply_markup, parse_mode, created_at FROM outbox ORDER BY id"
+    ).fetchall()
+    conn.execute("DELETE FROM outbox")
+    return [
+        Notification(
+            chat_id,
+            text,
+            InlineKeyboardMarkup.model_validate_json(reply_markup) if reply_markup else None,
+            parse_mode,
+            created_at=created_at,
+        )
+        for chat_id, text, reply_markup, parse_mode, created_at in rows
+    ]
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = 50
+TOP_N = 10
+REPORT_INTERVAL = 15 * 60
+# Раз в сколько инструкций виртуальной машины sqlite вызывается progress handler
+PROGRESS_STEPS = 1000
+
+# Служебные команды транзакций в статистику не попадают
+_SKIP = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "--")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\((?:\?,\s*)+\?\)")
+
+
+def normalize(sql):
+    # Одинаковые запросы с разными параметрами сводятся к одному шаблону
+    sql = _LITERALS.sub("?", " ".join(sql.split()))
+    return _IN_LISTS.sub("(...)", sql)
+
+
+class _Statement:
+    __slots__ = ("sql", "handler", "started", "steps")
+
+    def __init__(self, sql, handler):
+        self.sql = sql
+        self.handler = handler
+        self.started = time.perf_counter()
+        self.steps = 0
+
+
+class _ConnectionTrace:
+    # Состояние одного соединения. Каждое соединение живёт в своём потоке пула,
+    # поэтому сами колбэки блокировок не требуют.
+    def __init__(self, tracer, handler_var):
+        self.tracer = tracer
+        self.handler_var = handler_var
+        self.current = None
+        self.slow = []
+        self.explaining = False
+
+    def on_statement(self, sql):
+        # sqlite вызывает колбэк при запуске запроса, уже с подставленными параметрами.
+        # Время запроса считается до начала следующего или до конца транзакции,
+        # поэтому включает и выборку строк.
+        if self.explaining:
+            return
+        # Для каждой подпрограммы триггера колбэк вызывается ещё раз с тем же текстом
+        # запроса верхнего уровня (комментария "-- TRIGGER" Python 3.11 не передаёт):
+        # работа триггеров засчитывается в выполняющийся запрос
+        if self.current is not None and sql == self.current.sql:
+            return
+        self._close()
+        if not sql.lstrip().upper().startswith(_SKIP):
+            self.current = _Statement(sql, self.handler_var.get())
+
+    def on_progress(self):
+        if self.current is not None:
+            self.current.steps += PROGRESS_STEPS
+        return 0
+
+    def _close(self):
+        statement, self.current = self.current, None
+        if statement is None:
+            return
+        elapsed = time.perf_counter() - statement.started
+        self.tracer.record(statement, elapsed)
+        if elapsed * 1000 >= self.tracer.threshold_ms:
+            self.slow.append((statement, elapsed))
+
+    def finish(self, conn):
+        # Вызывается после транзакции, когда соединение снова можно использовать
+        self._close()
+        slow, self.slow = self.slow, []
+        for statement, elapsed in slow:
+            logger.warning(
+                "Медленный запрос %.1f мс (~%d шагов VM), обработчик %s:\n%s\nПлан:\n%s",
+                elapsed * 1000, statement.steps, statement.handler or "-", statement.sql,
+                self._plan(conn, statement.sql)
+            )
+
+    def _plan(self, conn, sql):
+        key = normalize(sql)
+        plan = self.tracer.plans.get(key)
+        if plan is None:
+            self.explaining = True
+            try:
+                rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+                plan = "\n".join(f"  {detail}" for _, _, _, detail in rows) or "  -"
+            except Exception as e:
+                plan = f"  не удалось получить план: {e}"
+            finally:
+                self.explaining = False
+            self.tracer.plans[key] = plan
+        return plan
+
+
+class QueryTracer:
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, top_n=TOP_N):
+        self.threshold_ms = threshold_ms
+        self.top_n = top_n
+        self.plans = {}
+        self._stats = {}  # шаблон -> [количество, суммарное время, максимум, шаги]
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    def install(self, conn, handler_var):
+        trace = self._connections[conn] = _ConnectionTrace(self, handler_var)
+        conn.set_trace_callback(trace.on_statement)
+        conn.set_progress_handler(trace.on_progress, PROGRESS_STEPS)
+
+    def finish(self, conn):
+        trace = self._connections.get(conn)
+        if trace is not None:
+            trace.finish(conn)
+
+    def record(self, statement, elapsed):
+        key = normalize(statement.sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += statement.steps
+
+    def top(self, n=None):
+        with self._lock:
+            items = [(key, *stats) for key, stats in self._stats.items()]
+        items.sort(key=lambda item: item[2], reverse=True)
+        return items[:n or self.top_n]
+
+    def report(self):
+        lines = [f"Самые дорогие запросы (топ {self.top_n} по суммарному времени):"]
+        for sql, count, total, longest, steps in self.top():
+            lines.append(
+                f"{total * 1000:9.1f} мс всего, {count:6d} раз, {total / count * 1000:7.2f} мс в среднем, "
+                f"{longest * 1000:7.1f} мс макс, ~{steps // count} шагов VM: {sql}"
+            )
+        return "\n".join(lines)
+
+    async def report_loop(self, interval=REPORT_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(self.report())
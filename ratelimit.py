@@ -0,0 +1,34 @@
+import time
+
+
+class TokenBucket:
+    # Ведро токенов с резервированием: take() сразу забирает токен и возвращает,
+    # сколько секунд нужно подождать, прежде чем им воспользоваться.
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def idle(self, now):
+        # Ведро полностью восстановилось — его можно удалить и создать заново при необходимости
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def try_take(self):
+        # Без резервирования: токен забирается, только если он есть
+        self._refill(time.monotonic())
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
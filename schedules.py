@@ -0,0 +1,183 @@
+from datetime import timedelta
+
+import cluster
+import db
+from cache import TTLCache
+
+WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+SCHEDULE_CACHE_SIZE = 2000
+SCHEDULE_CACHE_TTL = 600
+
+# Расписание хранится строками lessons (school, class, weekday, slot, group_number, subject).
+# Предмет, который делится по группам ("Английский/Информатика"), занимает один slot
+# и хранится отдельной строкой на каждую группу; общий урок — строкой с group_number NULL.
+#
+# Для чтения расписание класса один раз собирается в CompiledSchedule и кэшируется
+# по (school, class). schedule.version увеличивается при каждом сохранении.
+schedule_cache = TTLCache(SCHEDULE_CACHE_SIZE, SCHEDULE_CACHE_TTL)
+
+
+def split_subject(subject):
+    if "/" in subject:
+        return [(group, part.strip()) for group, part in enumerate(subject.split("/"), start=1)]
+    return [(None, subject)]
+
+
+def _group(user_group):
+    # В users группа хранится строкой ("1", "2")
+    return int(user_group) if user_group else None
+
+
+def lesson_rows(user_school, user_class, weekday, subjects):
+    rows = []
+    for slot, subject in enumerate(s for s in subjects if s):
+        for group, name in split_subject(subject):
+            rows.append((user_school, user_class, weekday, slot, group, name))
+    return rows
+
+
+class CompiledSchedule:
+    def __init__(self, version, rows):
+        # rows: (weekday, slot, group_number, subject), отсортированы по weekday, slot, group_number
+        self.version = version
+        self.groups = sorted({group for _, _, group, _ in rows if group is not None})
+
+        slots = {}
+        for weekday, slot, group, subject in rows:
+            slots.setdefault((weekday, slot), []).append((group, subject))
+
+        self.days = {}
+        for (weekday, slot), parts in slots.items():
+            self.days.setdefault(weekday, []).append(parts)
+
+        self._day_subjects = {}
+        self._all_subjects = {}
+        self._weekdays = {}
+        for group in [None] + self.groups:
+            all_subjects = set()
+            for weekday, day_slots in self.days.items():
+                subjects = []
+                for parts in day_slots:
+                    for part_group, subject in parts:
+                        if part_group is None or part_group == group:
+                            if subject not in subjects:
+                                subjects.append(subject)
+                            self._weekdays.setdefault((subject, group), set()).add(weekday)
+                self._day_subjects[(weekday, group)] = subjects
+                all_subjects.update(subjects)
+            self._all_subjects[group] = sorted(all_subjects)
+
+        # (subject, group) -> смещение в днях до ближайшего урока для каждого дня недели,
+        # чтобы "следующий урок" был одним обращением к словарю
+        self._next_offset = {}
+        for key, weekdays in self._weekdays.items():
+            self._next_offset[key] = tuple(
+                next((offset for offset in range(1, 8) if (today + offset) % 7 in weekdays), None)
+                for today in range(7)
+            )
+
+    def __bool__(self):
+        return bool(self.days)
+
+    def _resolve(self, user_group):
+        group = _group(user_group)
+        return group if group in self.groups else None
+
+    def as_dict(self):
+        # {"Понедельник": ["Алгебра", "Английский/Информатика", ...], ...}
+        return {
+            WEEKDAYS[weekday]: ["/".join(subject for _, subject in parts) for parts in day_slots]
+            for weekday, day_slots in self.days.items()
+        }
+
+    def day(self, weekday):
+        return ["/".join(subject for _, subject in parts) for parts in self.days.get(weekday, [])]
+
+    def subjects(self, user_group=None, weekday=None):
+        # Названия предметов с учётом группы: без группы делящиеся предметы пропускаются
+        group = self._resolve(user_group)
+        if weekday is not None:
+            return list(self._day_subjects.get((weekday, group), []))
+        return list(self._all_subjects.get(group, []))
+
+    def weekdays(self, subject, user_group=None):
+        return self._weekdays.get((subject, self._resolve(user_group)), set())
+
+    def next_lesson(self, subject, user_group, today):
+        offsets = self._next_offset.get((subject, self._resolve(user_group)))
+        if offsets is None:
+            return None
+        return today + timedelta(days=offsets[today.weekday()])
+
+
+def _load_compiled(conn, user_class, user_school):
+    row = conn.execute("SELECT version FROM schedule WHERE school = ? AND class = ?", (user_school, user_class)).fetchone()
+    rows = conn.execute(
+        "SELECT weekday, slot, group_number, subject FROM lessons "
+        "WHERE school = ? AND class = ? ORDER BY weekday, slot, group_number",
+        (user_school, user_class)
+    ).fetchall()
+    return CompiledSchedule(row[0] if row else 0, rows)
+
+
+async def get_compiled(user_class, user_school):
+    key = (user_school, user_class)
+    compiled = schedule_cache.get(key)
+    if compiled is not None:
+        return compiled
+
+    version = schedule_cache.version(key)
+    compiled = await db.run(_load_compiled, user_class, user_school)
+    # Если расписание успели изменить во время чтения, устаревшую версию не кэшируем
+    schedule_cache.set_if_unchanged(key, compiled, version)
+    return compiled
+
+
+def invalidate_schedule(user_class, user_school):
+    schedule_cache.invalidate((user_school, user_class))
+    cluster.publish(invalidate_schedule, user_class, user_school)
+
+
+def schedule_cache_stats():
+    return schedule_cache.stats()
+
+
+def replace_day(conn, user_id, user_class, user_school, weekday, subjects):
+    conn.execute(
+        "INSERT INTO schedule (user_id, class, school, version) VALUES (?, ?, ?, 1) "
+        "ON CONFLICT (school, class) DO UPDATE SET version = version + 1",
+        (user_id, user_class, user_school)
+    )
+    conn.execute("DELETE FROM lessons WHERE school = ? AND class = ? AND weekday = ?", (user_school, user_class, weekday))
+    conn.executemany(
+        "INSERT INTO lessons (school, class, weekday, slot, group_number, subject) VALUES (?, ?, ?, ?, ?, ?)",
+        lesson_rows(user_school, user_class, weekday, subjects)
+    )
+
+
+def _save_and_compile(conn, user_id, user_class, user_school, weekday, subjects):
+    replace_day(conn, user_id, user_class, user_school, weekday, subjects)
+    return _load_compiled(conn, user_class, user_school)
+
+
+async def save_day(user_id, user_class, user_school, weekday, subjects):
+    # Расписание компилируется сразу при сохранении, вместе с индексом следующих уроков
+    compiled = await db.run(_save_and_compile, user_id, user_class, user_school, weekday, subjects)
+    invalidate_schedule(user_class, user_school)
+    schedule_cache.set((user_school, user_class), compiled)
+
+
+async def load(user_class, user_school):
+    compiled = await get_compiled(user_class, user_school)
+    return compiled.as_dict() if compiled else None
+
+
+async def subjects_for(user_class, user_school, user_group=None, weekday=None):
+    compiled = await get_compiled(user_class, user_school)
+    return compiled.subjects(user_group, weekday)
+
+
+async def next_lesson_date(user_class, user_school, subject, user_group, today):
+    compiled = await get_compiled(user_class, user_school)
+    return compiled.next_lesson(subject, user_group, today)
@@ -0,0 +1,63 @@
+import bisect
+
+import cluster
+import db
+
+SCHOOLS_PAGE_SIZE = 10
+
+# Каталог школ для выбора при регистрации. Держится в памяти отсортированным
+# по названию без учёта регистра: поиск по началу названия — бинарный поиск,
+# по подстроке — один проход по списку. В callback_data уходит только id школы.
+_names = []  # отсортированные (название в нижнем регистре, id)
+_by_id = {}  # id -> название
+_loaded = False
+
+
+def _fold(name):
+    return name.casefold().replace("ё", "е")
+
+
+async def load():
+    global _names, _by_id, _loaded
+    rows = await db.fetchall("SELECT id, name FROM schools")
+    _by_id = dict(rows)
+    _names = sorted((_fold(name), school_id) for school_id, name in rows)
+    _loaded = True
+
+
+async def ensure_loaded():
+    if not _loaded:
+        await load()
+
+
+def add_school(school_id, name):
+    # Вызывается после одобрения школы, чтобы не перечитывать весь каталог
+    if school_id not in _by_id:
+        _by_id[school_id] = name
+        bisect.insort(_names, (_fold(name), school_id))
+    cluster.publish(add_school, school_id, name)
+
+
+def name_of(school_id):
+    return _by_id.get(school_id)
+
+
+def search(query=None):
+    # Сначала школы, название которых начинается с запроса, затем остальные совпадения
+    if not query:
+        return [school_id for _, school_id in _names]
+    query = _fold(query.strip())
+    start = bisect.bisect_left(_names, (query,))
+    prefix = []
+    for folded, school_id in _names[start:]:
+        if not folded.startswith(query):
+            break
+        prefix.append(school_id)
+    matched = set(prefix)
+    return prefix + [school_id for folded, school_id in _names if query in folded and school_id not in matched]
+
+
+def page(school_ids, number, page_size=SCHOOLS_PAGE_SIZE):
+    pages = max(1, (len(school_ids) + page_size - 1) // page_size)
+    number = min(max(number, 0), pages - 1)
+    return [(school_id, _by_id[school_id]) for school_id in school_ids[number * page_size:(number + 1) * page_size]], number, pages
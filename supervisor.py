@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+import cluster
+import db
+import migrations
+import synthetic
+
+logger = logging.getLogger(__name__)
+
+WORKERS = os.cpu_count() or 1
+# Сколько пользователей воркер обслуживает одновременно; апдейты одного
+# пользователя всегда попадают в одну полосу и обрабатываются по порядку
+WORKER_LANES = 32
+POLL_TIMEOUT = 30
+# Как часто супервизор проверяет, что воркеры живы, в секундах
+WATCH_INTERVAL = 1
+
+# Супервизор получает апдейты и раздаёт их процессам-воркерам по from_user.id,
+# поэтому все апдейты одного пользователя обрабатывает один воркер — его FSM
+# и порядок сообщений сохраняются. Воркеры работают с общей базой, а сбросы
+# кэшей пересылаются соседям через супервизор. Таблица fsm_state тоже общая,
+# но SQLiteStorage держит диалог в памяти своего процесса, так что правильность
+# FSM держится именно на маршрутизации по пользователю.
+
+
+def update_user_id(update):
+    for name, value in update.items():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user["id"]
+            chat = value.get("chat")
+            if chat:
+                return chat["id"]
+    return 0
+
+
+def route(update, workers):
+    return update_user_id(update) % workers
+
+
+def _worker_main(index, workers, db_path, inbox, events, dry_run):
+    db.configure(path=db_path)
+    # Модуль бота создаёт Bot и Dispatcher при импорте, поэтому импортируется уже в воркере
+    import bot as app
+    asyncio.run(_worker(app, index, workers, inbox, events, dry_run))
+
+
+async def _lane(app, queue):
+    while True:
+        update = await queue.get()
+        try:
+            await app.dp.feed_raw_update(app.bot, update)
+        except Exception:
+            logger.exception("Ошибка при обработке апдейта %s", update.get("update_id"))
+        finally:
+            queue.task_done()
+
+
+async def _worker(app, index, workers, inbox, events, dry_run):
+    from notifier import GLOBAL_RATE, Notifier
+
+    loop = asyncio.get_running_loop()
+    if dry_run:
+        app.bot.session = synthetic.StubSession()
+        # Строка лога на каждый апдейт заметно искажает замер
+        logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    # Лимит Telegram на рассылку общий для бота, делим его между воркерами
+    app.notifier = Notifier(app.bot, global_rate=GLOBAL_RATE / workers)
+    cluster.set_sink(lambda func, args: events.put(("invalidate", index, func, args)))
+
+    # Outbox, задачи по расписанию и команды бота — только в первом воркере
+    await app.notifier.start(restore=index == 0)
+    if index == 0:
+        app.start_cron_jobs()
+        if not dry_run:
+            await app.set_bot_commands(app.bot)
+
+    lanes = [asyncio.Queue() for _ in range(WORKER_LANES)]
+    consumers = [asyncio.create_task(_lane(app, lane)) for lane in lanes]
+    events.put(("ready", index))
+    processed = 0
+    try:
+        while True:
+            message = await loop.run_in_executor(None, inbox.get)
+            if message is None:
+                break
+            if message[0] == "update":
+                update = message[1]
+                lanes[update_user_id(update) // workers % WORKER_LANES].put_nowait(update)
+                processed += 1
+            elif message[0] == "invalidate":
+                cluster.apply(message[1], message[2])
+        for lane in lanes:
+            await lane.join()
+        events.put(("done", index, processed))
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        await app.notifier.stop()
+        await app.dp.storage.close()
+        await app.bot.session.close()
+        db.shutdown()
+
+
+class Supervisor:
+    def __init__(self, workers=WORKERS, db_path=db.DB_PATH, dry_run=False):
+        self.workers = workers
+        self.db_path = db_path
+        self.dry_run = dry_run
+        context = multiprocessing.get_context("spawn")
+        self._events = context.Queue()
+        self._inboxes = [context.Queue() for _ in range(workers)]
+        self._processes = [
+            context.Process(
+                target=_worker_main,
+                args=(index, workers, db_path, self._inboxes[index], self._events, dry_run),
+                name=f"worker-{index}",
+            )
+            for index in range(workers)
+        ]
+        self.done = {}
+        self.relayed = 0
+        self.failed = None
+        self._stopping = False
+
+    def submit(self, update):
+        # Апдейты упавшего воркера некому обработать — останавливаемся, а не копим их в его очереди
+        if self.failed:
+            raise RuntimeError(self.failed)
+        self._inboxes[route(update, self.workers)].put(("update", update))
+
+    def _dead_workers(self):
+        return [f"{process.name} (код {process.exitcode})" for process in self._processes if not process.is_alive()]
+
+    async def _next_event(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self._events.get)
+
+    async def start(self):
+        for process in self._processes:
+            process.start()
+        ready = 0
+        while ready < self.workers:
+            try:
+                event = await asyncio.get_running_loop().run_in_executor(None, self._events.get, True, 1)
+            except queue.Empty:
+                dead = self._dead_workers()
+                if dead:
+                    raise RuntimeError(f"Воркеры завершились при запуске: {', '.join(dead)}")
+                continue
+            if event[0] == "ready":
+                ready += 1
+        self._relay = asyncio.create_task(self._relay_events())
+        self._watch = asyncio.create_task(self._watch_workers())
+        logger.info("Запущено воркеров: %d", self.workers)
+
+    async def _watch_workers(self):
+        # Воркеры не перезапускаются: их очередь, полосы и FSM в памяти уже потеряны,
+        # поэтому падение воркера останавливает весь бот через submit() и poll()
+        while not self._stopping:
+            dead = self._dead_workers()
+            if dead:
+                self.failed = f"Воркеры завершились аварийно: {', '.join(dead)}"
+                logger.error(self.failed)
+                return
+            await asyncio.sleep(WATCH_INTERVAL)
+
+    async def _relay_events(self):
+        while True:
+            event = await self._next_event()
+            if event is None:
+                return
+            if event[0] == "invalidate":
+                _, source, func, args = event
+                for index, inbox in enumerate(self._inboxes):
+                    if index != source:
+                        inbox.put(("invalidate", func, args))
+                self.relayed += 1
+            elif event[0] == "done":
+                self.done[event[1]] = (event[2], time.perf_counter())
+
+    async def stop(self):
+        # Воркеры дорабатывают уже полученные апдейты и сохраняют состояние
+        self._stopping = True
+        self._watch.cancel()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join)
+        self._events.put(None)
+        await self._relay
+        # Воркер без отчёта "done" потерял часть апдейтов — итоги прогона неверны
+        lost = [process.name for index, process in enumerate(self._processes) if index not in self.done]
+        if lost:
+            raise RuntimeError(f"Воркеры не завершили работу: {', '.join(lost)}")
+
+    async def poll(self):
+        from aiogram import Bot
+        from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+        from config import TOKEN
+
+        bot = Bot(token=TOKEN)
+        offset = None
+        try:
+            await bot.delete_webhook()
+            while True:
+                if self.failed:
+                    raise RuntimeError(self.failed)
+                try:
+                    updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    logger.warning("Ошибка получения апдейтов: %s", e)
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    self.submit(update.model_dump(mode="json", exclude_unset=True))
+                    offset = update.update_id + 1
+        finally:
+            await bot.session.close()
+
+
+async def prepare_database(db_path, synthetic_users=0):
+    db.configure(path=db_path)
+    try:
+        await db.run(migrations.migrate)
+        if synthetic_users:
+            await db.run(synthetic.seed, synthetic_users)
+    finally:
+        db.shutdown()
+
+
+async def run_synthetic(workers, db_path, users, rounds, reuse=False):
+    # Локальная проверка масштабирования: апдейты генерируются без Telegram,
+    # а бот в воркерах отвечает через StubSession. Чтобы прогоны с разным числом
+    # воркеров сравнивали одну и ту же базу, она заполняется только при создании.
+    if os.path.exists(db_path) and not reuse:
+        raise SystemExit(f"{db_path} уже существует: удалите его или запустите с --reuse")
+    await prepare_database(db_path, 0 if reuse else users)
+    supervisor = Supervisor(workers, db_path, dry_run=True)
+    await supervisor.start()
+    started = time.perf_counter()
+    for update in synthetic.view_homework_flow(users, rounds):
+        supervisor.submit(update)
+    await supervisor.stop()
+    total = sum(processed for processed, _ in supervisor.done.values())
+    elapsed = max(finished for _, finished in supervisor.done.values()) - started
+    return total, elapsed
+
+
+async def main(args):
+    if args.synthetic:
+        total, elapsed = await run_synthetic(args.workers, args.db, args.synthetic, args.rounds, args.reuse)
+        print(f"Воркеров: {args.workers}, апдейтов: {total}, время: {elapsed:.2f} с, {total / elapsed:.0f} апдейтов/с")
+        return
+
+    await prepare_database(args.db)
+    supervisor = Supervisor(args.workers, args.db)
+    await supervisor.start()
+    try:
+        await supervisor.poll()
+    finally:
+        await supervisor.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--db", default=db.DB_PATH, help="путь к базе данных")
+    parser.add_argument("--synthetic", type=int, metavar="USERS", default=0,
+                        help="не подключаться к Telegram, а прогнать синтетические апдейты для USERS пользователей")
+    parser.add_argument("--rounds", type=int, default=1, help="сколько раз каждый синтетический пользователь открывает /viewhw")
+    parser.add_argument("--reuse", action="store_true", help="с --synthetic: взять уже заполненную базу, не заполняя её заново")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,253 @@
+import itertools
+import random
+import time
+import typing
+from datetime import datetime, timedelta
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message
+
+import dates
+from schedules import lesson_rows, replace_day
+
+# Синтетические данные и апдейты для локальной проверки производительности
+# без подключения к Telegram (supervisor.py --synthetic, benchmark.py).
+SUBJECTS = ["Алгебра", "Геометрия", "Русский язык", "Литература", "Физика", "Химия",
+            "История", "Биология", "Английский/Информатика", "Физкультура"]
+LESSONS_PER_DAY = 6
+CLASS_SIZE = 30
+
+
+class StubSession(BaseSession):
+    # Сессия бота, которая ничего не отправляет: методы, возвращающие Message,
+    # получают минимальное сообщение, остальные — True
+    async def make_request(self, bot, method, timeout=None):
+        returning = method.__returning__
+        if returning is Message or Message in typing.get_args(returning):
+            chat_id = getattr(method, "chat_id", None)
+            return Message(
+                message_id=1,
+                date=datetime.now(),
+                chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def class_of(user_id):
+    # Пользователи идут подряд по CLASS_SIZE человек в классе, 11 классов в школе
+    number = (user_id - 1) // CLASS_SIZE
+    return f"Школа {number // 11 + 1}", f"{number % 11 + 1} А"
+
+
+def seed(conn, users, homework_per_class=20):
+    rng = random.Random(0)
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (user_id, username, school, class, group_number, role) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (user_id, f"user{user_id}", *class_of(user_id), str(user_id % 2 + 1), "editor" if user_id % CLASS_SIZE == 1 else "viewer")
+            for user_id in range(1, users + 1)
+        ]
+    )
+    conn.executemany("INSERT OR IGNORE INTO schools (name) VALUES (?)", {(class_of(user_id)[0],) for user_id in range(1, users + 1)})
+
+    today = dates.today()
+    for first_user in range(1, users + 1, CLASS_SIZE):
+        user_school, user_class = class_of(first_user)
+        for weekday in range(6):
+            replace_day(conn, first_user, user_class, user_school, weekday, rng.sample(SUBJECTS, LESSONS_PER_DAY))
+        rows = []
+        for _ in range(homework_per_class):
+            due_day = today + rng.randint(-3, 7)
+            rows.append((first_user, dates.from_day(due_day).strftime("%y %m %d"), due_day, user_class, user_school,
+                         rng.choice(SUBJECTS).split("/")[0], "упр. %d" % rng.randint(1, 500), None))
+        conn.executemany(
+            "INSERT INTO homework (user_id, date, due_day, class, school, subject, task, group_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+
+LETTERS = "АБВГДЕЖЗ"
+
+
+def class_name(index, schools):
+    # Классы раскладываются по школам по кругу: 1 А, 2 А, ..., 11 А, 1 Б, ...
+    position = index // schools
+    grade = position % 11 + 1
+    letter = LETTERS[position // 11 % len(LETTERS)]
+    series = position // (11 * len(LETTERS))
+    return f"{grade} {letter}{series or ''}"
+
+
+def seed_scale(conn, schools, classes, users_per_class, homework_rows):
+    # Большая база для benchmark.py: школы, классы с расписанием на 6 дней,
+    # пользователи (первый в классе — редактор) и домашка вокруг сегодняшней даты
+    rng = random.Random(0)
+    school_names = [f"Школа №{number}" for number in range(1, schools + 1)]
+    conn.executemany("INSERT OR IGNORE INTO schools (name) VALUES (?)", [(name,) for name in school_names])
+    class_list = [(school_names[index % schools], class_name(index, schools)) for index in range(classes)]
+
+    def users():
+        user_id = 0
+        for user_school, user_class in class_list:
+            for position in range(users_per_class):
+                user_id += 1
+                role = "editor" if position == 0 else "viewer"
+                yield user_id, f"user{user_id}", user_school, user_class, str(position % 2 + 1), role
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (user_id, username, school, class, group_number, role) VALUES (?, ?, ?, ?, ?, ?)",
+        users()
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO schedule (user_id, class, school, version) VALUES (?, ?, ?, 1)",
+        [(index * users_per_class + 1, user_class, user_school) for index, (user_school, user_class) in enumerate(class_list)]
+    )
+
+    def lessons():
+        for user_school, user_class in class_list:
+            for weekday in range(6):
+                yield from lesson_rows(user_school, user_class, weekday, rng.sample(SUBJECTS, LESSONS_PER_DAY))
+
+    conn.executemany(
+        "INSERT INTO lessons (school, class, weekday, slot, group_number, subject) VALUES (?, ?, ?, ?, ?, ?)",
+        lessons()
+    )
+
+    today = dates.today()
+
+    def homework():
+        for _ in range(homework_rows):
+            index = rng.randrange(classes)
+            user_school, user_class = class_list[index]
+            due_day = today + rng.randint(-30, 14)
+            subject = rng.choice(SUBJECTS)
+            group = None
+            if "/" in subject:
+                group = rng.choice(("1", "2"))
+                subject = subject.split("/")[int(group) - 1]
+            yield (index * users_per_class + 1, dates.from_day(due_day).strftime("%y %m %d"), due_day,
+                   user_class, user_school, subject, "упр. %d" % rng.randint(1, 500), group)
+
+    conn.executemany(
+        "INSERT INTO homework (user_id, date, due_day, class, school, subject, task, group_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        homework()
+    )
+    return class_list
+
+
+_ids = itertools.count(1)
+
+
+def message(user_id, text):
+    return {
+        "update_id": next(_ids),
+        "message": {
+            "message_id": next(_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "user", "username": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+def callback(user_id, data):
+    return {
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)),
+            "chat_instance": "1",
+            "from": {"id": user_id, "is_bot": False, "first_name": "user", "username": f"user{user_id}"},
+            "message": {
+                "message_id": next(_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "Выберите дату:",
+            },
+            "data": data,
+        },
+    }
+
+
+def _tomorrow():
+    return (datetime.now() + timedelta(days=1)).strftime("%y %m %d")
+
+
+def registration(user_id, school_id, user_class, group):
+    # /start → школа → цифра класса → буква → группа
+    grade = user_class.split()[0]
+    return [
+        message(user_id, "/start"),
+        callback(user_id, f"school_{school_id}"),
+        callback(user_id, f"class_{grade}"),
+        callback(user_id, f"classn_{user_class}"),
+        callback(user_id, f"group_{group}"),
+    ]
+
+
+def add_homework(user_id, day, subject, task):
+    return [
+        message(user_id, "/addhw"),
+        callback(user_id, f"date_{day}"),
+        callback(user_id, f"subject_{subject}"),
+        message(user_id, task),
+    ]
+
+
+def view_homework(user_id, day):
+    return [message(user_id, "/viewhw"), callback(user_id, f"date_{day}")]
+
+
+def view_homework_flow(users, rounds=1):
+    # Каждый пользователь открывает /viewhw и выбирает завтрашний день
+    tomorrow = _tomorrow()
+    for _ in range(rounds):
+        for user_id in range(1, users + 1):
+            yield from view_homework(user_id, tomorrow)
+
+
+def conversations(schools, classes, users_per_class, new_users=100, editors=100, viewers=1000, seed=0):
+    # Сценарии для базы из seed_scale с теми же параметрами: новые пользователи
+    # регистрируются, редакторы классов добавляют домашку, ученики смотрят её.
+    # Возвращает список сценариев, по одному на пользователя.
+    rng = random.Random(seed)
+    tomorrow = _tomorrow()
+    scripts = []
+    first_new = classes * users_per_class + 1
+    for user_id in range(first_new, first_new + new_users):
+        index = rng.randrange(classes)
+        # seed_scale заполняет пустую таблицу schools, поэтому id школы совпадает с её номером
+        scripts.append(registration(user_id, index % schools + 1, class_name(index, schools), rng.choice((1, 2))))
+    editor_ids = set()
+    for index in rng.sample(range(classes), min(editors, classes)):
+        subject = rng.choice(SUBJECTS).split("/")[0]
+        editor_ids.add(index * users_per_class + 1)
+        scripts.append(add_homework(index * users_per_class + 1, tomorrow, subject, "упр. %d" % rng.randint(1, 500)))
+    # У пользователя один сценарий: шаги двух сценариев одного пользователя
+    # перемешались бы в interleave() и перезаписали бы друг другу состояние FSM
+    candidates = [user_id for user_id in range(1, classes * users_per_class + 1) if user_id not in editor_ids]
+    for user_id in rng.sample(candidates, min(viewers, len(candidates))):
+        scripts.append(view_homework(user_id, tomorrow))
+    return scripts
+
+
+def interleave(scripts):
+    # Шаги разных пользователей перемешиваются, порядок шагов одного пользователя сохраняется
+    position = [0] * len(scripts)
+    active = list(range(len(scripts)))
+    rng = random.Random(0)
+    while active:
+        slot = rng.randrange(len(active))
+        index = active[slot]
+        yield scripts[index][position[index]]
+        position[index] += 1
+        if position[index] == len(scripts[index]):
+            active[slot] = active[-1]
+            active.pop()
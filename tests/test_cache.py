@@ -0,0 +1,47 @@
+from cache import TTLCache
+
+
+def test_set_if_unchanged_stores_when_key_not_invalidated():
+    cache = TTLCache(10, 60)
+    version = cache.version("a")
+    cache.invalidate("b")
+    assert cache.set_if_unchanged("a", 1, version)
+    assert cache.get("a") == 1
+
+
+def test_set_if_unchanged_skips_value_read_before_invalidate():
+    cache = TTLCache(10, 60)
+    version = cache.version("a")
+    cache.invalidate("a")
+    assert not cache.set_if_unchanged("a", 1, version)
+    assert cache.get("a") is None
+    # Следующее чтение уже после сброса сохраняется
+    assert cache.set_if_unchanged("a", 2, cache.version("a"))
+    assert cache.get("a") == 2
+
+
+def test_invalidate_where_reaches_keys_being_loaded():
+    cache = TTLCache(10, 60)
+    loading = cache.version(("s", "5 А", 1))
+    other = cache.version(("s", "6 Б", 1))
+    cache.invalidate_where(lambda key: key[1] == "5 А")
+    assert not cache.set_if_unchanged(("s", "5 А", 1), "old", loading)
+    assert cache.set_if_unchanged(("s", "6 Б", 1), "ok", other)
+
+
+def test_clear_rejects_every_pending_load():
+    cache = TTLCache(10, 60)
+    version = cache.version("a")
+    cache.clear()
+    assert not cache.set_if_unchanged("a", 1, version)
+
+
+def test_forgotten_versions_never_accept_stale_values():
+    cache = TTLCache(2, 60)
+    version = cache.version("a")
+    cache.invalidate("a")
+    # Отметка "a" вытесняется из ограниченного словаря версий
+    for key in range(10):
+        cache.invalidate(key)
+    assert "a" not in cache._versions
+    assert not cache.set_if_unchanged("a", 1, version)
@@ -0,0 +1,122 @@
+import json
+import sqlite3
+from datetime import date
+
+import pytest
+
+import migrations
+from dates import to_day
+
+# Схема, которую создавал init_db() до появления миграций (PRAGMA user_version = 0)
+BASELINE_SCHEMA = [
+    '''CREATE TABLE homework (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        date TEXT,
+        group_number TEXT,
+        class TEXT,
+        school TEXT,
+        subject TEXT,
+        task TEXT)''',
+    '''CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        class TEXT,
+        school TEXT,
+        group_number TEXT,
+        role TEXT DEFAULT 'viewer',
+        balance INTEGER DEFAULT 0,
+        referrer_id INTEGER DEFAULT NULL,
+        editor_request BOOLEAN DEFAULT FALSE)''',
+    '''CREATE TABLE schedule (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        class TEXT,
+        school TEXT,
+        schedule_json TEXT)''',
+    '''CREATE TABLE schools (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE)''',
+]
+
+HOMEWORK = [
+    (1, "24 05 13", "Алгебра"),
+    (2, "14.05.2024", "Физика"),
+    (3, "завтра", "Химия"),
+    (4, "", "История"),
+    (5, None, "Труд"),
+]
+
+OLD_SCHEDULE = {"Понедельник": ["История"]}
+SCHEDULE = {
+    "Понедельник": ["Алгебра", "Английский/Информатика"],
+    "Вторник": [],
+    "Среда": ["", "Физика"],
+    "Каникулы": ["Отдых"],
+}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    for sql in BASELINE_SCHEMA:
+        conn.execute(sql)
+    conn.executemany(
+        "INSERT INTO homework (id, user_id, date, class, school, subject, task) VALUES (?, 1, ?, '5 А', 'S1', ?, 'Задание')",
+        HOMEWORK
+    )
+    # Дубли расписания одного класса: остаться должно последнее
+    conn.executemany(
+        "INSERT INTO schedule (user_id, class, school, schedule_json) VALUES (1, ?, 'S1', ?)",
+        [
+            ("5 А", json.dumps(OLD_SCHEDULE, ensure_ascii=False)),
+            ("5 А", json.dumps(SCHEDULE, ensure_ascii=False)),
+            ("6 Б", json.dumps(OLD_SCHEDULE, ensure_ascii=False)),
+        ]
+    )
+    conn.execute("INSERT INTO users (user_id, username, class, school) VALUES (1, 'teacher', '5 А', 'S1')")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_migrate_sets_user_version(conn):
+    assert migrations.migrate(conn) == len(migrations.MIGRATIONS)
+    assert migrations.get_version(conn) == len(migrations.MIGRATIONS)
+    # Повторный запуск ничего не применяет
+    assert migrations.migrate(conn) == len(migrations.MIGRATIONS)
+
+
+def test_legacy_dates_become_due_day(conn):
+    migrations.migrate(conn)
+    due_days = dict(conn.execute("SELECT id, due_day FROM homework"))
+    assert due_days == {
+        1: to_day(date(2024, 5, 13)),
+        2: to_day(date(2024, 5, 14)),
+        3: None,
+        4: None,
+        5: None,
+    }
+
+
+def test_duplicate_schedules_keep_the_latest(conn):
+    migrations.migrate(conn)
+    assert conn.execute("SELECT class, version FROM schedule ORDER BY class").fetchall() == [("5 А", 0), ("6 Б", 0)]
+    lessons = conn.execute(
+        "SELECT weekday, slot, group_number, subject FROM lessons WHERE school = 'S1' AND class = '5 А' "
+        "ORDER BY weekday, slot, group_number"
+    ).fetchall()
+    # Пустые уроки пропускаются, неизвестный день недели не переносится
+    assert lessons == [
+        (0, 0, None, "Алгебра"),
+        (0, 1, 1, "Английский"),
+        (0, 1, 2, "Информатика"),
+        (2, 0, None, "Физика"),
+    ]
+    assert conn.execute("SELECT subject FROM lessons WHERE class = '6 Б'").fetchall() == [("История",)]
+
+
+def test_existing_rows_are_searchable(conn):
+    migrations.migrate(conn)
+    assert conn.execute("SELECT rowid FROM homework_fts WHERE homework_fts MATCH 'алгебра'").fetchall() == [(1,)]
+    assert conn.execute("SELECT rowid FROM users_fts WHERE users_fts MATCH 'teach'").fetchall() == [(1,)]
@@ -0,0 +1,99 @@
+import ast
+import re
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import migrations
+
+ROOT = Path(__file__).resolve().parent.parent
+# Модули с запросами, которые выполняются на каждый апдейт или по расписанию
+MODULES = ["bot.py", "users.py", "homework.py", "schedules.py"]
+STATEMENT = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+# Запросы, для которых поиск по неподходящему индексу — тот же полный проход:
+# фрагмент текста запроса -> индекс, который должен быть в плане
+EXPECTED_INDEXES = {
+    "editor_request = TRUE AND role = 'viewer'": "idx_users_editor_candidates",
+}
+
+
+def _constants(tree):
+    # Строковые константы модуля, которые подставляются в f-строки запросов
+    constants = {}
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+                and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)):
+            constants[node.targets[0].id] = node.value.value
+    return constants
+
+
+def _text(node, constants):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _text(node.left, constants), _text(node.right, constants)
+        return left + right if left is not None and right is not None else None
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            elif isinstance(value.value, ast.Name) and value.value.id in constants:
+                parts.append(constants[value.value.id])
+            else:
+                return None
+        return "".join(parts)
+    return None
+
+
+def collect_queries():
+    # Первый аргумент каждого вызова, если это текст запроса: db.fetchone(...), conn.execute(...) и т. п.
+    queries = []
+    for module in MODULES:
+        tree = ast.parse((ROOT / module).read_text(encoding="utf-8"))
+        constants = _constants(tree)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and node.args:
+                sql = _text(node.args[0], constants)
+                if sql and STATEMENT.match(sql):
+                    queries.append(pytest.param(sql, id=f"{module}:{node.lineno}"))
+    return queries
+
+
+QUERIES = collect_queries()
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrations.migrate(conn)
+    yield conn
+    conn.close()
+
+
+def _plan(conn, sql):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?"))]
+
+
+def test_queries_are_collected():
+    assert len(QUERIES) >= 30
+    texts = [param.values[0] for param in QUERIES]
+    for fragment in EXPECTED_INDEXES:
+        assert any(fragment in sql for sql in texts), fragment
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_query_uses_index(conn, sql):
+    plan = _plan(conn, sql)
+    # SCAN по обычной таблице или индексу — полный проход; виртуальные таблицы FTS5 ищут по своему индексу
+    scans = [detail for detail in plan if detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail]
+    assert not scans, "\n".join([" ".join(sql.split())] + plan)
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_query_uses_expected_index(conn, sql):
+    for fragment, index in EXPECTED_INDEXES.items():
+        if fragment in sql:
+            plan = _plan(conn, sql)
+            assert any(f"INDEX {index} " in detail for detail in plan), "\n".join([" ".join(sql.split())] + plan)
@@ -0,0 +1,107 @@
+from datetime import date, timedelta
+
+import pytest
+
+from schedules import WEEKDAYS, CompiledSchedule, lesson_rows
+
+# Понедельник, с которого перебираются все дни недели
+MONDAY = date(2024, 5, 13)
+
+SCHEDULES = [
+    {
+        "Понедельник": ["Алгебра", "Английский/Информатика", "Физика"],
+        "Вторник": ["Физика"],
+        "Среда": [],
+        "Четверг": ["Информатика/Английский"],
+        "Пятница": ["Алгебра"],
+    },
+    {
+        "Вторник": ["Химия", "Труд/Черчение"],
+        "Пятница": ["Черчение/Труд", "Химия"],
+        "Суббота": ["Физкультура", "Химия"],
+    },
+    {
+        "Среда": ["История"],
+    },
+]
+
+
+def compile_schedule(schedule):
+    rows = []
+    for day, subjects in schedule.items():
+        rows += lesson_rows("S1", "5 А", WEEKDAYS.index(day), subjects)
+    # Тот же порядок, что ORDER BY weekday, slot, group_number в _load_compiled (NULL первым)
+    rows = sorted(
+        ((weekday, slot, group, subject) for _, _, weekday, slot, group, subject in rows),
+        key=lambda row: (row[0], row[1], -1 if row[2] is None else row[2])
+    )
+    return CompiledSchedule(1, rows)
+
+
+def subjects_of(schedule):
+    return sorted({part.strip() for subjects in schedule.values() for subject in subjects for part in subject.split("/")})
+
+
+def loop_next_lesson(schedule, subject, user_group, today):
+    # Прежний find_next_lesson_date: перебор 14 дней вперёд с учётом групп
+    for i in range(1, 14):
+        day = today + timedelta(days=i)
+        for s in schedule.get(WEEKDAYS[day.weekday()], []):
+            if "/" in s:
+                if user_group and s.split("/")[int(user_group) - 1] == subject:
+                    return day
+            elif s == subject:
+                return day
+    return None
+
+
+def loop_next_weekday_lesson(schedule, subject, today):
+    # Прежний process_next_subject: 7 дней вперёд, только будни, предмет без деления на группы
+    for i in range(1, 8):
+        day = today + timedelta(days=i)
+        if day.weekday() >= 5:
+            continue
+        if subject in schedule.get(WEEKDAYS[day.weekday()], []):
+            return day
+    return None
+
+
+@pytest.mark.parametrize("schedule", SCHEDULES)
+@pytest.mark.parametrize("user_group", [None, "1", "2"])
+def test_next_lesson_matches_day_loop(schedule, user_group):
+    compiled = compile_schedule(schedule)
+    for offset in range(7):
+        today = MONDAY + timedelta(days=offset)
+        for subject in subjects_of(schedule) + ["Нет такого"]:
+            assert compiled.next_lesson(subject, user_group, today) == loop_next_lesson(schedule, subject, user_group, today), (
+                subject, user_group, today
+            )
+
+
+@pytest.mark.parametrize("schedule", SCHEDULES)
+def test_next_lesson_matches_weekday_loop(schedule):
+    # Прежний цикл не знал о субботе и группах, поэтому сравниваем там, где он определён
+    weekdays_only = {day: subjects for day, subjects in schedule.items() if WEEKDAYS.index(day) < 5}
+    compiled = compile_schedule(weekdays_only)
+    shared = [subject for subject in subjects_of(weekdays_only) if compiled.weekdays(subject)]
+    for offset in range(7):
+        today = MONDAY + timedelta(days=offset)
+        for subject in shared:
+            assert compiled.next_lesson(subject, None, today) == loop_next_weekday_lesson(weekdays_only, subject, today), (
+                subject, today
+            )
+
+
+def test_split_subject_is_found_only_for_its_group():
+    compiled = compile_schedule(SCHEDULES[0])
+    # В понедельник английский у первой группы, в четверг — у второй
+    assert compiled.next_lesson("Английский", "1", MONDAY) == MONDAY + timedelta(days=7)
+    assert compiled.next_lesson("Английский", "2", MONDAY) == MONDAY + timedelta(days=3)
+    assert compiled.next_lesson("Английский", None, MONDAY) is None
+
+
+def test_saturday_lesson_after_friday():
+    compiled = compile_schedule(SCHEDULES[1])
+    friday = MONDAY + timedelta(days=4)
+    assert compiled.next_lesson("Физкультура", None, friday) == friday + timedelta(days=1)
+    assert compiled.next_lesson("Химия", None, friday + timedelta(days=1)) == friday + timedelta(days=4)
@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import cluster
+import db
+from cache import TTLCache
+
+EDITOR_ROLES = ("editor", "vip", "admin")
+
+PROFILE_CACHE_SIZE = 10000
+PROFILE_CACHE_TTL = 300
+
+USER_SEARCH_PAGE_SIZE = 10
+# Триграммный индекс users_fts не ищет подстроки короче трёх символов
+USER_SEARCH_MIN_LENGTH = 3
+USER_SEARCH_COLUMNS = "u.user_id, u.username, u.class, u.school, u.role, u.balance"
+
+# Профили активных пользователей почти не меняются, поэтому держим их в памяти.
+# Все места, где меняются поля users, обязаны вызвать invalidate_profile().
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    user_id: int
+    username: Optional[str]
+    user_class: Optional[str]
+    school: Optional[str]
+    group_number: Optional[str]
+    role: str
+    balance: int
+    referrer_id: Optional[int]
+    editor_request: bool
+    digest: bool
+
+    @property
+    def is_banned(self):
+        return self.role == "ban"
+
+    @property
+    def is_admin(self):
+        return self.role == "admin"
+
+    @property
+    def is_editor_or_vip(self):
+        return self.role in EDITOR_ROLES
+
+    @property
+    def has_school_and_class(self):
+        return self.school is not None and self.user_class is not None
+
+
+async def load_profile(user_id):
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+
+    version = profile_cache.version(user_id)
+    row = await db.fetchone(
+        "SELECT user_id, username, class, school, group_number, role, balance, referrer_id, editor_request, digest "
+        "FROM users WHERE user_id = ?",
+        (user_id,)
+    )
+    if row is None:
+        return None
+    user_id, username, user_class, school, group_number, role, balance, referrer_id, editor_request, digest = row
+    profile = UserProfile(
+        user_id=user_id,
+        username=username,
+        user_class=user_class,
+        school=school,
+        group_number=group_number,
+        role=role,
+        balance=balance,
+        referrer_id=referrer_id,
+        editor_request=bool(editor_request),
+        digest=bool(digest),
+    )
+    # Если во время запроса профиль успели изменить, устаревшую строку не кэшируем
+    profile_cache.set_if_unchanged(user_id, profile, version)
+    return profile
+
+
+def invalidate_profile(*user_ids):
+    for user_id in user_ids:
+        profile_cache.invalidate(user_id)
+    cluster.publish(invalidate_profile, *user_ids)
+
+
+def profile_cache_stats():
+    return profile_cache.stats()
+
+
+def _search_users(conn, query, after_id, limit):
+    # Точные совпадения (Telegram ID, @username) проверяются первыми и не смешиваются
+    # с поиском по подстроке. Страницы листаются курсором по user_id: "после такого-то id".
+    if query.isdigit():
+        rows = conn.execute(f"SELECT {USER_SEARCH_COLUMNS} FROM users u WHERE u.user_id = ?", (int(query),)).fetchall()
+        if rows:
+            return [] if after_id else rows
+    if query.startswith("@"):
+        query = query[1:]
+        if conn.execute("SELECT 1 FROM users WHERE username = ? COLLATE NOCASE", (query,)).fetchone():
+            return conn.execute(
+                f"SELECT {USER_SEARCH_COLUMNS} FROM users u WHERE u.username = ? COLLATE NOCASE AND u.user_id > ? "
+                "ORDER BY u.user_id LIMIT ?",
+                (query, after_id, limit)
+            ).fetchall()
+    if len(query) < USER_SEARCH_MIN_LENGTH:
+        return []
+    # Весь запрос — одна фраза: как и раньше с LIKE, ищется подстрока в username, классе или школе
+    phrase = '"' + query.replace('"', '""') + '"'
+    return conn.execute(
+        f"SELECT {USER_SEARCH_COLUMNS} FROM users_fts f JOIN users u ON u.user_id = f.rowid "
+        "WHERE users_fts MATCH ? AND f.rowid > ? ORDER BY f.rowid LIMIT ?",
+        (phrase, after_id, limit)
+    ).fetchall()
+
+
+async def search_users(query, after_id=0, page_size=USER_SEARCH_PAGE_SIZE):
+    # Возвращает (пользователи страницы, есть ли следующая страница);
+    # следующая страница запрашивается с after_id = user_id последнего пользователя
+    rows = await db.run(_search_users, query.strip(), after_id, page_size + 1)
+    return rows[:page_size], len(rows) > page_size
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+# Сколько апдейтов обрабатывается одновременно; остальные запросы ждут своей очереди
+WEBHOOK_CONCURRENCY = 64
+# Сколько соединений Telegram может держать к серверу (1-100, см. setWebhook)
+WEBHOOK_MAX_CONNECTIONS = 40
+
+
+def _concurrency_limit(limit):
+    semaphore = asyncio.Semaphore(limit)
+
+    @web.middleware
+    async def middleware(request, handler):
+        async with semaphore:
+            return await handler(request)
+
+    return middleware
+
+
+def create_app(dp, bot, secret, path=WEBHOOK_PATH, concurrency=WEBHOOK_CONCURRENCY):
+    # Апдейт обрабатывается внутри запроса, поэтому ограничение на число запросов
+    # ограничивает и число одновременно работающих обработчиков.
+    # Запросы без верного X-Telegram-Bot-Api-Secret-Token получают 401.
+    app = web.Application(middlewares=[_concurrency_limit(concurrency)])
+    SimpleRequestHandler(dp, bot, handle_in_background=False, secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run(dp, bot, secret, url=None, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+              concurrency=WEBHOOK_CONCURRENCY, max_connections=WEBHOOK_MAX_CONNECTIONS):
+    app = create_app(dp, bot, secret, path, concurrency)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        # Без url вебхук в Telegram не регистрируется: так сервер можно проверить локально,
+        # отправляя сохранённые апдейты POST-запросами
+        if url:
+            await bot.set_webhook(url + path, secret_token=secret, max_connections=max_connections,
+                                  allowed_updates=dp.resolve_used_update_types())
+        logger.info("Вебхук слушает http://%s:%d%s", host, port, path)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()